@@ -0,0 +1,137 @@
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils.data import COMMAS_PATH, GLOBAL_PATH, RATES_PATH, ACCOUNT_IDS_PATH
+from utils.rates import BTC_CURRENCY_ID, USD_CURRENCY_ID
+
+# Synthetic input files with the schemas of data/, for benchmarking the
+# pipelines without production data. The 3Commas volumes are written chunk
+# by chunk, so files far larger than memory can be generated.
+#
+#   python -m bench.generate --rows 10000000 --out bench/data/10M
+
+# Raw account_type spellings the preprocessing has to clean, and the paper
+# accounts it drops
+ACCOUNT_TYPE_FORMATS = ['Account::{}', 'Accounts::{}', '{} Account']
+PAPER_ACCOUNT_TYPES = ['Account::Paper', 'Accounts::PaperTrading']
+SUBSCRIPTIONS = ['free', 'starter', 'pro', 'expert']
+SUBSCRIPTION_TYPES = ['monthly', 'annual']
+# Zipf exponent of the rows per user
+USER_SKEW = 0.8
+CHUNK_ROWS = 1_000_000
+PARAMS_NAME = 'params.json'
+
+
+def zipf_weights(n, skew):
+    # Probabilities of n ranked items, the first ones taking most of the mass
+    # as skew grows. skew=0 is uniform.
+    weights = 1 / np.arange(1, n + 1) ** skew
+    return weights / weights.sum()
+
+
+def account_types(account_ids):
+    # Every raw 3Commas spelling of the exchanges of account_ids.csv
+    names = account_ids['3commas'].drop_duplicates()
+    return [ACCOUNT_TYPE_FORMATS[i % len(ACCOUNT_TYPE_FORMATS)].format(name) for i, name in enumerate(names)] + \
+        PAPER_ACCOUNT_TYPES
+
+
+def commas_chunk(rng, rows, months, user_weights, types, type_weights, tail):
+    # One chunk of 3Commas volume rows. The most active users own most rows,
+    # and the amounts follow a Pareto tail: the smaller tail is, the heavier
+    # the whales.
+    return pd.DataFrame({
+        'user_id': 100_000 + rng.choice(len(user_weights), rows, p=user_weights),
+        'month': rng.choice(months, rows),
+        'account_type': rng.choice(types, rows, p=type_weights),
+        'exchange_type': rng.choice(['spot', 'future'], rows, p=[0.7, 0.3]),
+        'subscription': rng.choice(SUBSCRIPTIONS, rows, p=[0.4, 0.3, 0.2, 0.1]),
+        'subscription_type': rng.choice(SUBSCRIPTION_TYPES, rows, p=[0.8, 0.2]),
+        'usd_amount': np.round((rng.pareto(tail, rows) + 1) * 100, 2),
+    })
+
+
+def write_commas_volumes(path, rows, users, months, skew, tail, seed, account_ids):
+    rng = np.random.default_rng(seed)
+    user_weights = zipf_weights(users, USER_SKEW)
+    types = account_types(account_ids)
+    type_weights = zipf_weights(len(types), skew)
+    month_strings = months.strftime('%Y-%m-%d').to_numpy()
+    for start in range(0, rows, CHUNK_ROWS):
+        chunk = commas_chunk(rng, min(CHUNK_ROWS, rows - start), month_strings, user_weights, types, type_weights, tail)
+        chunk.to_csv(path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+
+
+def write_exchange_volumes(path, months, seed, account_ids):
+    # One row per global exchange and day, and a few exchanges missing from
+    # account_ids.csv
+    rng = np.random.default_rng(seed + 1)
+    names = list(account_ids['Global'].drop_duplicates()) + ['unlisted_exchange', 'unlisted_dex']
+    days = pd.date_range(months[0], months[-1] + pd.offsets.MonthEnd(), freq='D')
+    report_date = np.repeat(days.strftime('%Y-%m-%d').to_numpy(), len(names))
+    exchange_name = np.tile(names, len(days))
+    pd.DataFrame({
+        'report_date': report_date,
+        'exchange_name': exchange_name,
+        'exchange_type': np.where(pd.Series(exchange_name).str.contains('futures|swap|dm|derivatives'), 'futures', 'spot'),
+        'btc_volume': (rng.pareto(1.5, len(report_date)) + 1) * 1000,
+    }).to_csv(path, index=False)
+
+
+def write_currency_rates(path, months, seed, gap_rate=0.1):
+    # Daily BTC/USD rates as a random walk, with a share of the days missing
+    # to exercise the as-of conversion
+    rng = np.random.default_rng(seed + 2)
+    days = pd.date_range(months[0], months[-1] + pd.offsets.MonthEnd(), freq='D')
+    days = days[rng.random(len(days)) >= gap_rate]
+    rates = 40_000 * np.exp(np.cumsum(rng.normal(0, 0.02, len(days))))
+    pd.DataFrame({
+        'from_currency_id': BTC_CURRENCY_ID,
+        'to_currency_id': USD_CURRENCY_ID,
+        'date': days.strftime('%Y-%m-%d %H:%M:%S.000'),
+        'open': rates,
+    }).to_csv(path, index=False)
+
+
+def generate(out_dir, rows, users=None, months=12, skew=1.2, tail=1.16, seed=0):
+    # Write the three input files and account_ids.csv into out_dir, unless
+    # it already holds them for the same parameters. users defaults to one
+    # per 20 rows.
+    out_dir = Path(out_dir)
+    params = {'rows': rows, 'users': users or max(rows // 20, 1), 'months': months,
+              'skew': skew, 'tail': tail, 'seed': seed}
+    params_path = out_dir / PARAMS_NAME
+    if params_path.exists() and json.loads(params_path.read_text()) == params:
+        return out_dir
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    params_path.unlink(missing_ok=True)
+    account_ids = pd.read_csv(ACCOUNT_IDS_PATH)
+    month_range = pd.date_range('2024-01-01', periods=months, freq='MS')
+    write_commas_volumes(out_dir / COMMAS_PATH.name, rows, params['users'], month_range, skew, tail, seed, account_ids)
+    write_exchange_volumes(out_dir / GLOBAL_PATH.name, month_range, seed, account_ids)
+    write_currency_rates(out_dir / RATES_PATH.name, month_range, seed)
+    account_ids.to_csv(out_dir / ACCOUNT_IDS_PATH.name, index=False)
+    params_path.write_text(json.dumps(params, indent=2))
+    return out_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic dashboard input files.')
+    parser.add_argument('--rows', type=float, required=True, help='3Commas volume rows, e.g. 1e6')
+    parser.add_argument('--out', type=Path, required=True)
+    parser.add_argument('--users', type=int, help='distinct users, rows / 20 by default')
+    parser.add_argument('--months', type=int, default=12)
+    parser.add_argument('--skew', type=float, default=1.2, help='Zipf exponent of the account type mix')
+    parser.add_argument('--tail', type=float, default=1.16, help='Pareto index of the volumes, lower is heavier')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.out, int(args.rows), args.users, args.months, args.skew, args.tail, args.seed)
+
+
+if __name__ == '__main__':
+    main()
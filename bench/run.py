@@ -0,0 +1,228 @@
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from bench.generate import generate
+from utils.benchmark import build_benchmark
+from utils.cube import FilterCube
+from utils.data import COMMAS_PATH, GLOBAL_PATH, RATES_PATH, ACCOUNT_IDS_PATH, SCHEMAS, read_csv_typed
+from utils.exchanges import build_exchange_map
+from utils.funcs import ATTRIBUTE_COLUMNS, preprocess_data, build_user_month_attributes, aggregate_account_months
+from utils.profiling import rss_bytes
+from utils.rates import RateTable
+from utils.streaming import DEFAULT_CHUNKSIZE, preprocess_chunks
+from utils.user_index import UserIndex
+
+# Scaling benchmark of the dashboard pipelines on synthetic data. Every size
+# runs in its own process, and every stage records its wall time and its
+# peak resident memory above what the earlier stages left behind. Results
+# are written as JSON, and two result files can be compared to catch
+# regressions.
+#
+#   python -m bench.run --rows 1e6 1e7 1e8
+#   python -m bench.run --compare bench/results/before.json bench/results/after.json
+
+BENCH_DIR = Path(__file__).parent
+DATA_DIR = BENCH_DIR / 'data'
+RESULTS_DIR = BENCH_DIR / 'results'
+DEFAULT_ROWS = [1_000_000, 10_000_000, 100_000_000]
+
+# Slower or larger than the baseline by more than this ratio is a regression
+DEFAULT_THRESHOLD = 1.2
+
+# Seconds between two samples of the resident memory
+SAMPLE_INTERVAL = 0.005
+
+
+class PeakMemory:
+    # Samples the resident memory from a background thread while a stage
+    # runs. Unlike tracemalloc it does not slow the stage down, and it also
+    # sees the memory allocated by pyarrow.
+
+    def __enter__(self):
+        self.start = self.peak = rss_bytes()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._done.wait(SAMPLE_INTERVAL):
+            self.peak = max(self.peak, rss_bytes())
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+    @property
+    def peak_mb(self):
+        return (self.peak - self.start) / 2**20
+
+
+def _read_commas(state):
+    state['raw'] = read_csv_typed(state['dir'] / COMMAS_PATH.name, SCHEMAS[COMMAS_PATH.name])
+
+
+def _preprocess(state):
+    state['df'], state['df_monthly'] = preprocess_data(state.pop('raw'))
+
+
+def _user_month_attributes(state):
+    state['attrs'] = build_user_month_attributes(state['df'])
+
+
+def _account_months(state):
+    state['account_months'] = aggregate_account_months(state['df'])
+
+
+def _filter_cube(state):
+    state['cube'] = FilterCube(state['attrs'], state['df_monthly'])
+
+
+def _segment_query(state):
+    # The segment page with every filter value selected
+    cells = state['cube'].cells
+    state['cube'].query(['A', 'B', 'C', 'D'], {c: cells[c].unique() for c in ATTRIBUTE_COLUMNS})
+
+
+def _user_index(state):
+    index = UserIndex(state['attrs'], state['df_monthly'])
+    index.user_rows(state['df_monthly']['user_id'].iloc[0])
+    index.search('1000')
+
+
+def _benchmark(state):
+    # Everything but the 3Commas aggregates is read here, they are small
+    global_vols = read_csv_typed(state['dir'] / GLOBAL_PATH.name, SCHEMAS[GLOBAL_PATH.name])
+    rate_table = RateTable(read_csv_typed(state['dir'] / RATES_PATH.name, SCHEMAS[RATES_PATH.name]))
+    exchange_map = build_exchange_map(pd.read_csv(state['dir'] / ACCOUNT_IDS_PATH.name))
+    build_benchmark(state['account_months'], global_vols, rate_table, exchange_map)
+
+
+def _release(state):
+    # Not a pipeline stage, frees the in-memory results before streaming
+    for key in ['df', 'df_monthly', 'attrs', 'account_months', 'cube']:
+        state.pop(key, None)
+
+
+def _streaming(state):
+    path = state['dir'] / COMMAS_PATH.name
+    with read_csv_typed(path, SCHEMAS[COMMAS_PATH.name], chunksize=DEFAULT_CHUNKSIZE) as chunks:
+        preprocess_chunks(chunks)
+
+
+STAGES = [
+    ('read_csv', _read_commas),
+    ('preprocess', _preprocess),
+    ('user_month_attributes', _user_month_attributes),
+    ('account_months', _account_months),
+    ('filter_cube', _filter_cube),
+    ('segment_query', _segment_query),
+    ('user_index', _user_index),
+    ('benchmark', _benchmark),
+    (None, _release),
+    ('streaming', _streaming),
+]
+
+
+def run_stages(data_dir):
+    # Time every stage on the files of data_dir, in a fresh process. Each
+    # stage reads what the previous ones left in state.
+    state = {'dir': Path(data_dir)}
+    results = []
+    for name, stage in STAGES:
+        with PeakMemory() as memory:
+            started = time.perf_counter()
+            stage(state)
+            seconds = time.perf_counter() - started
+        if name is not None:
+            results.append({'stage': name, 'seconds': round(seconds, 4), 'peak_mb': round(memory.peak_mb, 1)})
+    # Peak resident memory of the whole process, kilobytes on Linux
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+    return results, round(max_rss_mb, 1)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=BENCH_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(rows_list, data_dir=DATA_DIR, **generate_args):
+    report = {
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'generate': generate_args,
+        'results': [],
+    }
+    for rows in rows_list:
+        size_dir = generate(Path(data_dir) / f"{rows}", rows, **generate_args)
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results, max_rss_mb = pool.submit(run_stages, size_dir).result()
+        for result in results:
+            report['results'].append({'rows': rows, **result})
+            print(f"{rows:>12,} {result['stage']:<24} {result['seconds']:>9.3f}s {result['peak_mb']:>9.1f} MB")
+        print(f"{rows:>12,} {'max rss':<24} {'':>10} {max_rss_mb:>9.1f} MB")
+        report['results'].append({'rows': rows, 'stage': 'max_rss', 'seconds': None, 'peak_mb': max_rss_mb})
+    return report
+
+
+def compare(before, after, threshold=DEFAULT_THRESHOLD):
+    # Ratio of every (rows, stage) measure of after over before, and whether
+    # any of them got worse than the threshold
+    before = pd.DataFrame(before['results']).set_index(['rows', 'stage'])
+    after = pd.DataFrame(after['results']).set_index(['rows', 'stage'])
+    both = before.join(after, how='inner', lsuffix='_before', rsuffix='_after')
+    for measure in ['seconds', 'peak_mb']:
+        both[f'{measure}_ratio'] = both[f'{measure}_after'] / both[f'{measure}_before']
+    both['regression'] = (both[['seconds_ratio', 'peak_mb_ratio']] > threshold).any(axis=1)
+    return both
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard pipelines on synthetic data.')
+    parser.add_argument('--rows', type=float, nargs='+', default=DEFAULT_ROWS)
+    parser.add_argument('--data-dir', type=Path, default=DATA_DIR, help='where the generated inputs are kept')
+    parser.add_argument('--out', type=Path, help='result file, bench/results/<time>.json by default')
+    parser.add_argument('--months', type=int, default=12)
+    parser.add_argument('--skew', type=float, default=1.2)
+    parser.add_argument('--tail', type=float, default=1.16)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', type=Path, nargs=2, metavar=('BEFORE', 'AFTER'))
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.compare:
+        before, after = (json.loads(path.read_text()) for path in args.compare)
+        both = compare(before, after, args.threshold)
+        with pd.option_context('display.width', 200, 'display.max_rows', None):
+            print(both.round(3))
+        sys.exit(1 if both['regression'].any() else 0)
+
+    report = run([int(rows) for rows in args.rows], args.data_dir,
+                 months=args.months, skew=args.skew, tail=args.tail, seed=args.seed)
+    out = args.out or RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(f"results written to {out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import argparse
+import ast
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+# Cold start measurement of the dashboard. Every measure runs in a fresh
+# interpreter so nothing is imported or cached beforehand:
+#   imports       the top-level imports of each page script
+#   first render  a full run of each page script, the first one of a process
+#   after home    a run of each page script once the home page has run and
+#                 the background warm-up it starts has finished
+#
+#   python -m bench.startup
+#   python -m bench.startup --repeat 5 --out startup.json
+
+ROOT = Path(__file__).parent.parent
+PAGES = ['streamlit_app.py'] + sorted(str(p.relative_to(ROOT)) for p in (ROOT / 'pages').glob('*.py'))
+
+_IMPORTS = """
+import sys, time
+sys.path.insert(0, {root!r})
+code = compile({source!r}, {page!r}, 'exec')
+started = time.perf_counter()
+exec(code, {{}})
+print(time.perf_counter() - started)
+"""
+
+_RENDER = """
+import sys, threading, time, warnings
+warnings.filterwarnings('ignore')
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({path!r}, default_timeout=600).run()
+assert not at.exception, [e.message for e in at.exception]
+print(time.perf_counter() - started, flush=True)
+# The page starts the warm-up as it ends, let it finish before exiting
+for thread in threading.enumerate():
+    if thread.name == 'dashboard-warmup':
+        thread.join()
+"""
+
+_AFTER_HOME = """
+import sys, threading, time, warnings
+warnings.filterwarnings('ignore')
+sys.path.insert(0, {root!r})
+from streamlit.testing.v1 import AppTest
+AppTest.from_file({home!r}, default_timeout=600).run()
+for thread in threading.enumerate():
+    if thread.name == 'dashboard-warmup':
+        thread.join()
+started = time.perf_counter()
+at = AppTest.from_file({path!r}, default_timeout=600).run()
+assert not at.exception, [e.message for e in at.exception]
+print(time.perf_counter() - started)
+"""
+
+
+def _top_level_imports(path):
+    # Source of the import statements at the top level of a script
+    tree = ast.parse(Path(path).read_text())
+    return '\n'.join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def _time(script):
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, cwd=ROOT)
+    if result.returncode:
+        raise RuntimeError(result.stderr)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def measure(pages=PAGES, repeat=3):
+    # Best of repeat fresh-process runs of every measure, in seconds
+    results = []
+    for page in pages:
+        path = ROOT / page
+        imports = min(_time(_IMPORTS.format(root=str(ROOT), source=_top_level_imports(path), page=page))
+                      for _ in range(repeat))
+        render = min(_time(_RENDER.format(root=str(ROOT), path=str(path))) for _ in range(repeat))
+        after_home = min(_time(_AFTER_HOME.format(root=str(ROOT), home=str(ROOT / PAGES[0]), path=str(path)))
+                         for _ in range(repeat))
+        results.append({'page': page, 'imports': round(imports, 3), 'first_render': round(render, 3),
+                        'after_home': round(after_home, 3)})
+        print(f"{page:<36} imports {imports:>7.3f}s   first render {render:>7.3f}s   after home {after_home:>7.3f}s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the import and first render time of the pages.')
+    parser.add_argument('--pages', nargs='+', default=PAGES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--out', type=Path, help='write the results as JSON')
+    args = parser.parse_args()
+    results = measure(args.pages, args.repeat)
+    if args.out:
+        args.out.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from utils.data import (COMMAS_PATH, GLOBAL_PATH, RATES_PATH, ACCOUNT_IDS_PATH, STORE_DIR, MANIFEST_NAME,
+                        AGGREGATE_TABLES, columnar_copy, input_signatures, read_dataset, load_store_table)
+from utils.benchmark import aggregate_global_months
+from utils.exchanges import build_exchange_map, exchange_match_report
+from utils.rates import RateTable, TOLERANCE_DAYS
+from utils.store import ingest, drop_partitions, write_months, write_benchmark, write_derived, write_manifest
+
+
+# Batch engine: precomputes every table and structure the dashboard reads
+# into the store, so the pages only load result files.
+#
+#   python main.py                  rebuild everything from data/
+#   python main.py --months 2024-05 recompute only the given months
+#   python main.py --from-store     keep the stored 3Commas months (fed by
+#                                   python -m utils.store) and only rebuild
+#                                   the global side and the benchmark, of
+#                                   the given months with --months
+
+
+def _aggregate_month(parquet_path, month, store_dir):
+    # Worker: read only the rows of one month from the columnar copy and
+    # store its aggregates
+    start = pd.Timestamp(month)
+    stop = start + pd.offsets.MonthBegin()
+    df = pd.read_parquet(parquet_path, filters=[('month', '>=', start), ('month', '<', stop)])
+    ingest(df, store_dir)
+    return start, len(df)
+
+
+def source_months(parquet_path):
+    months = pd.read_parquet(parquet_path, columns=['month'])['month']
+    return sorted(months.dt.to_period('M').dt.start_time.unique())
+
+
+def aggregate_months(months, workers, store_dir):
+    parquet_path = columnar_copy(COMMAS_PATH)
+    rebuild = not months
+    if rebuild:
+        months = source_months(parquet_path)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_aggregate_month, parquet_path, month, store_dir) for month in months]
+        for future in futures:
+            month, rows = future.result()
+            print(f"{month:%Y-%m}: {rows} rows aggregated")
+    if rebuild:
+        # Every month is replaced, drop the months the source no longer has
+        for table in AGGREGATE_TABLES:
+            drop_partitions(store_dir, table, keep=months)
+
+
+def write_global_months(months, store_dir, tolerance):
+    # Store the global side of the benchmark per month. Only the rows of the
+    # given months are read from the columnar copy, all of them by default.
+    if months:
+        filters = [[('report_date', '>=', month), ('report_date', '<', month + pd.offsets.MonthBegin())]
+                   for month in months]
+        global_vols = pd.read_parquet(columnar_copy(GLOBAL_PATH), filters=filters)
+    else:
+        global_vols = read_dataset(GLOBAL_PATH)
+    account_months = load_store_table('account_months', store_dir, columns=['month', 'account_type'])
+    if account_months is None:
+        raise SystemExit('the store has no 3Commas months, run python main.py first')
+    account_types = account_months['account_type']
+    exchange_map = build_exchange_map(pd.read_csv(ACCOUNT_IDS_PATH))
+    report = exchange_match_report(account_types, global_vols['exchange_name'], exchange_map)
+    for name in report['unmatched_3commas']:
+        print(f"unmatched 3Commas account type: {name}")
+    for name in report['unmatched_global']:
+        print(f"unmatched global exchange: {name}")
+    for row in report['ambiguous'].itertuples():
+        print(f"ambiguous {row.side} name: {row.name} -> {row.account_id}")
+
+    rate_table = RateTable(read_dataset(RATES_PATH))
+    global_months = aggregate_global_months(global_vols, rate_table, exchange_map, tolerance)
+    unconverted = global_months['unconverted_rows'].sum()
+    if unconverted:
+        print(f"{unconverted} global volume rows had no BTC rate within {tolerance}")
+    if not months:
+        # Rebuilt whole, drop the months the source no longer has
+        months = [pd.Timestamp(month) for month in sorted(global_months['month'].unique())]
+        drop_partitions(store_dir, 'global_months', keep=months)
+    write_months(global_months, 'global_months', months, store_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute the dashboard datasets.')
+    parser.add_argument('--store-dir', type=Path, default=STORE_DIR)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--months', nargs='*', help='months to recompute as YYYY-MM, all by default')
+    parser.add_argument('--rate-tolerance-days', type=float, default=TOLERANCE_DAYS,
+                        help='oldest BTC rate used to convert a global volume')
+    parser.add_argument('--from-store', action='store_true', help='do not recompute the 3Commas months')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    months = [pd.Timestamp(m + '-01') for m in args.months] if args.months else None
+    if not args.from_store and not months:
+        # A full rebuild replaces the store month by month. Until the new
+        # manifest is written the pages compute their tables from data/,
+        # which the new store is built from, instead of reading a mix of
+        # old and new months.
+        (args.store_dir / MANIFEST_NAME).unlink(missing_ok=True)
+    if not args.from_store:
+        aggregate_months(months, args.workers, args.store_dir)
+    # The filter cube, user index, leaderboards and segment migration of
+    # every stored month, so the pages only unpickle them
+    for name in write_derived(args.store_dir):
+        print(f"{name}: built")
+    write_global_months(months, args.store_dir, pd.Timedelta(days=args.rate_tolerance_days))
+    benchmark = write_benchmark(months, args.store_dir)
+    print(f"benchmark: {len(benchmark)} rows")
+
+    signatures = input_signatures()
+    if args.from_store:
+        signatures.pop(COMMAS_PATH.name, None)
+    write_manifest(signatures, args.rate_tolerance_days, args.store_dir)
+    print(f"done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
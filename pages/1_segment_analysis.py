@@ -1,25 +1,34 @@
-import pandas as pd
 import streamlit as st
-import random
-from pathlib import Path
 import plotly.graph_objects as go
-import plotly.express as px
-from utils.funcs import load_logo,create_stacked_bar_chart
+from utils.funcs import create_stacked_bar_chart,custom_colors,ATTRIBUTE_COLUMNS
+from utils.startup import load_logo, start_warmup
+from utils.charts import scatter
+from utils.profiling import start_run, stage, render_debug_panel
 
 load_logo()
-from utils.funcs import preprocess_data
+start_run('segment_analysis')
+from utils.data import load_filter_cube, load_leaderboards, load_sql_backend, aggregates_version, BACKEND
+from utils.result_cache import results, canonical_key
 
 
 # Set wide layout for the app
 st.set_page_config(layout='wide')
 
-# Load the dataset
-path = Path(__file__).parent.parent
-path_csv = path / 'data/3Commas Volumes.csv'
-df = pd.read_csv(path_csv)
-
-# Preprocess the data
-df, df_monthly = preprocess_data(df)
+# Load the pre-aggregated filter cube, cached once per process, or query
+# the input files with the SQL backend when it is selected
+backend = load_sql_backend()
+if backend is None:
+    cube = load_filter_cube()
+    cells = cube.cells
+    options = {column: cells[column].unique() for column in ATTRIBUTE_COLUMNS}
+    query, query_quantiles = cube.query, cube.quantiles
+    top_traders = load_leaderboards().top
+    frames = {'cube cells': cells}
+else:
+    options = backend.attribute_values()
+    query, query_quantiles = backend.segment_summary, backend.segment_quantiles
+    top_traders = backend.top_traders
+    frames = {}
 
 # Streamlit Application
 st.markdown("""
@@ -32,41 +41,86 @@ segments = ['A', 'B', 'C', 'D']
 selected_segments = st.sidebar.multiselect('Select User Segments', segments, default=segments)
 
 # Additional filters in the sidebar
-selected_account_type = st.sidebar.multiselect('Select Account Type', df['account_type'].unique(), default=df['account_type'].unique())
-selected_exchange_type = st.sidebar.multiselect('Select Exchange Type', df['exchange_type'].unique(), default=df['exchange_type'].unique())
-selected_subscription = st.sidebar.multiselect('Select Subscription', df['subscription'].unique(), default=df['subscription'].unique())
-selected_subscription_type = st.sidebar.multiselect('Select Subscription Type', df['subscription_type'].unique(), default=df['subscription_type'].unique())
-
-# Filter data based on selected segments and additional filters
-df_filtered = df_monthly[df_monthly['user_segment'].isin(selected_segments)]
-df_filtered = df_filtered.merge(df[['user_id', 'account_type', 'exchange_type', 'subscription', 'subscription_type']], on='user_id')
-df_filtered = df_filtered[(df_filtered['account_type'].isin(selected_account_type)) &
-                          (df_filtered['exchange_type'].isin(selected_exchange_type)) &
-                          (df_filtered['subscription'].isin(selected_subscription)) &
-                          (df_filtered['subscription_type'].isin(selected_subscription_type))]
+selected_account_type = st.sidebar.multiselect('Select Account Type', options['account_type'], default=options['account_type'])
+selected_exchange_type = st.sidebar.multiselect('Select Exchange Type', options['exchange_type'], default=options['exchange_type'])
+selected_subscription = st.sidebar.multiselect('Select Subscription', options['subscription'], default=options['subscription'])
+selected_subscription_type = st.sidebar.multiselect('Select Subscription Type', options['subscription_type'], default=options['subscription_type'])
+selected_quantile = st.sidebar.selectbox('Select Volume Quantile', ['p50', 'p90', 'p99'])
+leaderboard_account_type = st.sidebar.selectbox('Select Leaderboard Account Type', selected_account_type)
+
+# Slice the cube with the selected segments and additional filters
+filters = {
+    'account_type': selected_account_type,
+    'exchange_type': selected_exchange_type,
+    'subscription': selected_subscription,
+    'subscription_type': selected_subscription_type,
+}
+
+def build_charts():
+    summary = query(selected_segments, filters)
+
+    # 1. Trader Count Monthly by Segment
+    monthly_segment_count = summary['users'].unstack().fillna(0)
+    fig_count = create_stacked_bar_chart(monthly_segment_count, 'Trader Count Monthly by Segment', 'User Count')
+
+    # 2. Segment Percent by Total User Count Monthly
+    # Every user-month has a single segment, so the segment counts add up
+    monthly_total_users = summary['users'].groupby(level='month').sum()
+    monthly_segment_percent = monthly_segment_count.div(monthly_total_users, axis=0) * 100
+    fig_percent = create_stacked_bar_chart(monthly_segment_percent, 'Segment Percent by Total User Count Monthly', 'Percentage of Users',percent=True)
+
+    # 3. Average Volume per User
+    monthly_avg_volume = (summary['usd_amount'] / summary['users']).unstack().fillna(0)
+    fig_avg_volume = create_stacked_bar_chart(monthly_avg_volume, 'Average Volume per User', 'Average Volume($)')
+
+    # 4. Volume quantile per user, approximated by the sketches of the cube
+    monthly_quantile = query_quantiles(selected_segments, filters)[selected_quantile].unstack()
+    fig_quantile = go.Figure()
+    for segment, color in zip(monthly_quantile.columns, custom_colors):
+        fig_quantile.add_trace(scatter(monthly_quantile.index, monthly_quantile[segment], name=segment,
+                                       line=dict(color=color)))
+    fig_quantile.update_layout(title=f'{selected_quantile} Volume per User', xaxis_title='Month',
+                               yaxis_title=f'{selected_quantile} Volume($)', yaxis_type='log', template='plotly_white')
+    return fig_count, fig_percent, fig_avg_volume, fig_quantile
+
+# Views already built by any session are served from the result cache
+key = canonical_key(aggregates_version(), page='segment_analysis', backend=BACKEND, segments=selected_segments,
+                    quantile=selected_quantile, **filters)
+fig_count, fig_percent, fig_avg_volume, fig_quantile = results.get_or_compute(key, build_charts)
+
+# Top traders of the account type over every month, merged from the monthly
+# leaderboards
+leaderboard = None
+if leaderboard_account_type is not None:
+    leaderboard_key = canonical_key(aggregates_version(), page='segment_analysis', backend=BACKEND,
+                                    leaderboard=leaderboard_account_type)
+    leaderboard = results.get_or_compute(leaderboard_key, lambda: top_traders([leaderboard_account_type]))
 
 # Layout with two columns
 col1, col2 = st.columns(2)
 
-# 1. Trader Count Monthly by Segment
-monthly_segment_count = df_filtered.groupby(['month', 'user_segment'])['user_id'].nunique().unstack().fillna(0)
-
 with col1:
     # Plot stacked bar chart using Plotly for user count
-    fig_count = create_stacked_bar_chart(monthly_segment_count, 'Trader Count Monthly by Segment', 'User Count')
-    st.plotly_chart(fig_count)
-
-# 2. Segment Percent by Total User Count Monthly
-monthly_total_users = df_filtered.groupby('month')['user_id'].nunique()
-monthly_segment_percent = monthly_segment_count.div(monthly_total_users, axis=0) * 100
+    with stage('plotly_chart'):
+        st.plotly_chart(fig_count)
 
 with col2:
     # Plot stacked bar chart using Plotly for percentage
-    fig_percent = create_stacked_bar_chart(monthly_segment_percent, 'Segment Percent by Total User Count Monthly', 'Percentage of Users',percent=True)
-    st.plotly_chart(fig_percent)
+    with stage('plotly_chart'):
+        st.plotly_chart(fig_percent)
 st.markdown("<hr style='border: 2px solid #00B0A3;'>", unsafe_allow_html=True)
-# 3. Average Volume per User
-monthly_avg_volume = df_filtered.groupby(['month', 'user_segment'])['usd_amount'].mean().unstack().fillna(0)
-fig_avg_volume = create_stacked_bar_chart(monthly_avg_volume, 'Average Volume per User', 'Average Volume($)')
-st.plotly_chart(fig_avg_volume)
+with stage('plotly_chart'):
+    st.plotly_chart(fig_avg_volume)
+
+col3, col4 = st.columns(2)
+with col3:
+    with stage('plotly_chart'):
+        st.plotly_chart(fig_quantile)
+with col4:
+    if leaderboard is not None:
+        st.subheader(f'Top Traders: {leaderboard_account_type}')
+        st.dataframe(leaderboard, hide_index=True)
 
+# Load the data of the other pages in the background, once this page has rendered
+start_warmup()
+render_debug_panel(frames)
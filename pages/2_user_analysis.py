@@ -1,24 +1,21 @@
-import pandas as pd
 import streamlit as st
-import random
-from pathlib import Path
 import plotly.graph_objects as go
-import plotly.express as px
-from utils.funcs import load_logo,format_number
+from utils.funcs import format_number
+from utils.startup import load_logo, start_warmup
+from utils.profiling import start_run, stage, render_debug_panel
 
 load_logo()
-from utils.funcs import preprocess_data
+start_run('user_analysis')
+from utils.data import load_user_index, aggregates_version
+from utils.result_cache import results, canonical_key
+from utils.migration import count_transitions
+from utils.charts import BASE_LAYOUT, scatter
 
 # Set wide layout for the app
 st.set_page_config(layout='wide')
 
-# Load the dataset
-path = Path(__file__).parent.parent
-path_csv = path / 'data/3Commas Volumes.csv'
-df = pd.read_csv(path_csv)
-
-# Preprocess the data
-df, df_monthly = preprocess_data(df)
+# Load the per-user index of the preprocessed dataset, cached once per process
+user_index = load_user_index()
 
 # Streamlit Application
 st.markdown("""
@@ -27,52 +24,93 @@ st.markdown("""
     </div>
 """, unsafe_allow_html=True)
 
-# Additional filters in the sidebar
-user_ids = df['user_id'].unique().tolist()
+# Search the user IDs by prefix, only the matches are sent to the browser
 default_id = 259930
-# selected_user_id = st.sidebar.text_input('Or Enter User ID to see detailed metrics:', value=default_id)
-# selected_user_id = int(selected_user_id)
-selected_user_id = st.sidebar.selectbox('Select a User ID from the list:', options=user_ids, index=user_ids.index(default_id))
-
+user_query = st.sidebar.text_input('Search User ID:', value=str(default_id))
+with stage('user search'):
+    user_ids = user_index.search(user_query)
+selected_user_id = st.sidebar.selectbox('Select a User ID from the matches:', options=user_ids)
+if selected_user_id is None:
+    st.write('User ID not found in the dataset.')
+    start_warmup()
+    render_debug_panel({'user_month_attributes': user_index.attrs, 'user_months': user_index.monthly})
+    st.stop()
 
-user_data = df[df['user_id'] == selected_user_id]
-df_monthly = df_monthly[df_monthly['user_id'] == selected_user_id]
+# Rows of the selected user, looked up by binary search in the index
+with stage('user lookup') as s:
+    user_data = user_index.user_rows(selected_user_id)
+    user_monthly = user_index.user_months(selected_user_id)
+    s.rows_out = len(user_data)
 
 # Filter data based on selected segments and additional filters
-user_data = user_data[['user_id','month','account_type', 'exchange_type', 'subscription', 'subscription_type']].merge(df_monthly, on=['user_id','month'])
+user_data = user_data.merge(user_monthly, on=['user_id','month'])
 
 
 selected_account_type = st.sidebar.multiselect('Select Account Type', user_data['account_type'].unique(), default=user_data['account_type'].unique())
 selected_exchange_type = st.sidebar.multiselect('Select Exchange Type', user_data['exchange_type'].unique(), default=user_data['exchange_type'].unique())
 selected_subscription = st.sidebar.multiselect('Select Subscription', user_data['subscription'].unique(), default=user_data['subscription'].unique())
 selected_subscription_type = st.sidebar.multiselect('Select Subscription Type', user_data['subscription_type'].unique(), default=user_data['subscription_type'].unique())
-df_filtered = user_data[(user_data['account_type'].isin(selected_account_type)) &
-                          (user_data['exchange_type'].isin(selected_exchange_type)) &
-                          (user_data['subscription'].isin(selected_subscription)) &
-                          (user_data['subscription_type'].isin(selected_subscription_type))]
+filters = {
+    'account_type': selected_account_type,
+    'exchange_type': selected_exchange_type,
+    'subscription': selected_subscription,
+    'subscription_type': selected_subscription_type,
+}
+
+def build_user_view():
+    df_filtered = user_data[(user_data['account_type'].isin(selected_account_type)) &
+                              (user_data['exchange_type'].isin(selected_exchange_type)) &
+                              (user_data['subscription'].isin(selected_subscription)) &
+                              (user_data['subscription_type'].isin(selected_subscription_type))]
+
+    df_filtered = df_filtered.drop_duplicates(subset=['month','usd_amount'])
+    volume_dynamics = df_filtered.groupby(['month','user_segment'], as_index=False, observed=True).agg({'usd_amount': 'sum'})  # Volume dynamics
+    segment_names = volume_dynamics['user_segment'].unique().tolist()  # Segments the user hit
+    view = {
+        'total_volume': df_filtered['usd_amount'].sum(),
+        'segment_names': ','.join(segment_names),
+        'segment_changes_counts': count_transitions(volume_dynamics['user_segment']),  # How many times the user changed segment
+        'a_segment_count': volume_dynamics[volume_dynamics.user_segment=='A'].shape[0],  # How many times the user hit segment A
+        'fig_volume_dynamics': None,
+    }
+    if df_filtered.empty:
+        return view
+
+    fig_volume_dynamics = go.Figure(layout=BASE_LAYOUT)
+    fig_volume_dynamics.add_trace(scatter(
+        volume_dynamics['month'].dt.strftime('%b %Y'),
+        volume_dynamics['usd_amount'],
+        mode='lines+markers',
+        name='Volume Dynamics',
+        line=dict(color='#00B0A3')
+    ))
+    fig_volume_dynamics.update_layout(
+        xaxis_title='Month',
+        yaxis_title='Volume',
+        title_text='Volume Dynamics Over Time',
+    )
+    view['fig_volume_dynamics'] = fig_volume_dynamics
+    return view
+
+# Popular users are served from the result cache
+key = canonical_key(aggregates_version(), page='user_analysis', user_id=int(selected_user_id), **filters)
+view = results.get_or_compute(key, build_user_view)
 
-df_filtered = df_filtered.drop_duplicates(subset=['month','usd_amount'])
-# Generate a list of random user IDs to select from
 col1,col2 ,col3,col4 = st.columns(4)
 with col1:
-    total_volume = df_filtered['usd_amount'].sum()
     st.markdown(
     f"""
     <div style='background-color: #00B0A3; padding: 8px; border-radius: 15px; box-shadow: 0px 4px 12px rgba(0, 0, 0, 0.1); margin-bottom: 20px; transform: scale(0.75);'>
         <h4 style='margin: 0; text-align: center;'> Total Volume</h4>
-        <p style='font-size: 44px; color: white;text-align:center;'>{format_number(total_volume)}</p>
+        <p style='font-size: 44px; color: white;text-align:center;'>{format_number(view['total_volume'])}</p>
     </div>
     """,unsafe_allow_html=True)
 with col2:
-    volume_dynamics = df_filtered.groupby(['month','user_segment'], as_index=False).agg({'usd_amount': 'sum'})  # Volume dynamics
-    segment_changes = volume_dynamics['user_segment'].unique().tolist()  # How many times the user hit different segments
-    segment_names = ','.join(segment_changes)
-    segment_changes_counts = len(segment_changes)  # How many times the user hit different segments
     st.markdown(
     f"""
     <div style='background-color: #00B0A3; padding: 8px; border-radius: 15px; box-shadow: 0px 4px 12px rgba(0, 0, 0, 0.1); margin-bottom: 20px; transform: scale(0.75);'>
         <h4 style='margin: 0; text-align: center;'>Segment Change Count</h4>
-        <p style='font-size: 44px; color: white;text-align:center;'>{segment_changes_counts:.0f}  </p>
+        <p style='font-size: 44px; color: white;text-align:center;'>{view['segment_changes_counts']:.0f}  </p>
     </div>
     """,unsafe_allow_html=True)
 with col3:
@@ -80,51 +118,25 @@ with col3:
     f"""
     <div style='background-color: #00B0A3; padding: 8px; border-radius: 15px; box-shadow: 0px 4px 12px rgba(0, 0, 0, 0.1); margin-bottom: 20px; transform: scale(0.75);'>
         <h4 style='margin: 0; text-align: center;'>Segments </h4>
-        <p style='font-size: 44px; color: white;text-align: center;'>{segment_names} </p>
+        <p style='font-size: 44px; color: white;text-align: center;'>{view['segment_names']} </p>
     </div>
     """,unsafe_allow_html=True)
 with col4:
-    a_segment_count = volume_dynamics[volume_dynamics.user_segment=='A'].shape[0]  # How many times the user hit segment A
     st.markdown(
     f"""
     <div style='background-color: #00B0A3; padding: 8px; border-radius: 15px; box-shadow: 0px 4px 12px rgba(0, 0, 0, 0.1); margin-bottom: 20px; transform: scale(0.75);'>
         <h4 style='margin: 0; text-align: center;'>A Segment Count</h4>
-        <p style='font-size: 44px; color: white;text-align: center;'>{a_segment_count:.0f} </p>
+        <p style='font-size: 44px; color: white;text-align: center;'>{view['a_segment_count']:.0f} </p>
     </div>
     """,unsafe_allow_html=True)
 
 if selected_user_id:
-    if not df_filtered.empty:
-        fig_volume_dynamics = go.Figure()
-        fig_volume_dynamics.add_trace(go.Scatter(
-            x=volume_dynamics['month'].dt.strftime('%b %Y'),
-            y=volume_dynamics['usd_amount'],
-            mode='lines+markers',
-            name='Volume Dynamics',
-            line=dict(color='#00B0A3')
-        ))
-        fig_volume_dynamics.update_layout(
-            xaxis_title='Month',
-            yaxis_title='Volume',
-            title='Volume Dynamics Over Time',
-            font=dict(
-                family="Helvetica, Arial, sans-serif",
-                size=14,
-                color="#333"
-            ),
-            title_font=dict(
-                family="Helvetica, Arial, sans-serif",
-                size=18,
-                color="#00B0A3"
-            ),
-            legend=dict(
-                font=dict(
-                    family="Helvetica, Arial, sans-serif",
-                    size=12,
-                    color="#333"
-                )
-            )
-        )
-        st.plotly_chart(fig_volume_dynamics)
+    if view['fig_volume_dynamics'] is not None:
+        with stage('plotly_chart'):
+            st.plotly_chart(view['fig_volume_dynamics'])
     else:
         st.write('User ID not found in the dataset.')
+
+# Load the data of the other pages in the background, once this page has rendered
+start_warmup()
+render_debug_panel({'user_month_attributes': user_index.attrs, 'user_months': user_index.monthly})
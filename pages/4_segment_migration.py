@@ -0,0 +1,96 @@
+import streamlit as st
+import plotly.graph_objects as go
+
+from utils.startup import load_logo, start_warmup
+from utils.data import load_segment_migration, aggregates_version
+from utils.result_cache import results, canonical_key
+from utils.profiling import start_run, stage, render_debug_panel
+
+load_logo()
+start_run('segment_migration')
+
+st.set_page_config(layout='wide')
+
+# Transitions and per-user metrics of every user, computed once per process
+migration = load_segment_migration()
+
+st.markdown("""
+    <div style='background-color: #00B0A3; padding: 20px; border-radius: 10px;'>
+        <h1 style='text-align: center; color: white;'>Segment Migration</h1>
+    </div>
+""", unsafe_allow_html=True)
+
+# Sidebar for filtering, a month stands for its transition to the next month
+st.sidebar.title('Filters')
+month_options = migration.months[:-1]
+selected_months = st.sidebar.multiselect('Select Starting Month', month_options, default=list(month_options),
+                                         format_func=lambda month: month.strftime('%b %Y'))
+show_shares = st.sidebar.checkbox('Show shares of the starting segment', value=True)
+selected_segment = st.sidebar.selectbox('Track Segment', migration.segments)
+
+
+def build_charts():
+    matrix = migration.matrix(selected_months, normalize=show_shares)
+    fig_matrix = go.Figure(go.Heatmap(
+        z=matrix.to_numpy(),
+        x=matrix.columns,
+        y=matrix.index,
+        text=matrix.map(lambda v: f'{v:.1%}' if show_shares else f'{v:,.0f}').to_numpy(),
+        texttemplate='%{text}',
+        colorscale=[[0, '#ffffff'], [1, '#00B0A3']],
+        showscale=False,
+    ))
+    fig_matrix.update_layout(
+        title='Month-over-Month Segment Transitions',
+        xaxis_title='To Segment',
+        yaxis_title='From Segment',
+        yaxis=dict(autorange='reversed'),
+        template='plotly_white',
+    )
+
+    flows = migration.flows(selected_segment)
+    flows = flows[flows.index.isin(selected_months)]
+    labels = flows.index.strftime('%b %Y')
+    fig_flows = go.Figure()
+    fig_flows.add_trace(go.Bar(x=labels, y=flows['into'], name=f'Into {selected_segment}', marker_color='#00B0A3'))
+    fig_flows.add_trace(go.Bar(x=labels, y=-flows['out_of'], name=f'Out of {selected_segment}', marker_color='#a7abb8'))
+    fig_flows.add_trace(go.Scatter(x=labels, y=flows['stayed'], name=f'Stayed in {selected_segment}',
+                                   mode='lines+markers', line=dict(color='#17a2b8')))
+    fig_flows.update_layout(
+        title=f'Users Moving Into and Out of Segment {selected_segment}',
+        xaxis_title='From Month',
+        yaxis_title='Users',
+        barmode='relative',
+        template='plotly_white',
+    )
+
+    # Users with the longest streaks in the tracked segment
+    streaks = migration.users.nlargest(20, f'longest_{selected_segment}')
+    return fig_matrix, fig_flows, streaks
+
+
+key = canonical_key(aggregates_version(), page='segment_migration', months=selected_months, shares=show_shares,
+                    segment=selected_segment)
+fig_matrix, fig_flows, streaks = results.get_or_compute(key, build_charts)
+
+col1, col2 = st.columns(2)
+with col1, stage('plotly_chart'):
+    st.plotly_chart(fig_matrix, width='stretch')
+with col2, stage('plotly_chart'):
+    st.plotly_chart(fig_flows, width='stretch')
+
+st.subheader(f'Longest Streaks in Segment {selected_segment}')
+st.dataframe(streaks)
+
+# Metrics of a single user, looked up by binary search
+user_query = st.sidebar.text_input('Look up User ID:')
+if user_query:
+    user = migration.user(int(user_query)) if user_query.strip().isdigit() else None
+    if user is None:
+        st.sidebar.write('User ID not found in the dataset.')
+    else:
+        st.sidebar.dataframe(user.astype(str).rename('value'))
+
+# Load the data of the other pages in the background, once this page has rendered
+start_warmup()
+render_debug_panel({'user_migration': migration.users})
@@ -1,8 +1,5 @@
 import streamlit as st
-from utils.funcs import load_logo
-
-from pathlib import Path
-from PIL import Image
+from utils.startup import load_logo, start_warmup
 
 load_logo()
 
@@ -35,19 +32,12 @@ st.markdown(
         # Convert month to datetime format
         df['month'] = pd.to_datetime(df['month'])
 
-        # Define the volume categories
-        def categorize_user(volume):
-            if volume >= 2000000:
-                return 'A'
-            elif volume >= 200000:
-                return 'B'
-            elif volume >= 20000:
-                return 'C'
-            elif volume >= 1:
-                return 'D'
-            else:
-                return None
-            ...
+        # Aggregate the volume per user per month
+        df_monthly = df.groupby(['user_id', pd.Grouper(key='month', freq='MS')], as_index=False).agg({'usd_amount': 'sum'})
+
+        # Segment each user-month by the highest volume threshold it reaches
+        df_monthly['user_segment'] = segment_volumes(df_monthly['usd_amount'], scheme={'A': 2000000, 'B': 200000, 'C': 20000, 'D': 1})
+        ...
     ```
 
     2. <span style='font-size: 18px; font-weight: bold;'>Segment Analysis</span>: <span style='font-size: 18px;'>In this step, I provided the number and percentage of traders per month for each segment (A, B, C, D) based on previous cleaning step.</span>
@@ -64,3 +54,7 @@ st.markdown(
     """,
     unsafe_allow_html=True
 )
+
+# Load the data of the other pages in the background, once the page has
+# rendered so it does not compete with it
+start_warmup()
@@ -0,0 +1,79 @@
+import pandas as pd
+
+from utils.exchanges import map_account_ids
+from utils.funcs import month_start, replace_values
+from utils.profiling import profiled
+from utils.rates import BTC_CURRENCY_ID, USD_CURRENCY_ID, DEFAULT_TOLERANCE
+
+
+@profiled()
+def aggregate_global_months(global_vols, rate_table, exchange_map, tolerance=DEFAULT_TOLERANCE):
+    # The global side of the benchmark: global volumes keyed by account_id
+    # with the resolved exchange map and converted to USD, per month,
+    # account_id and exchange type. A month only depends on its own rows.
+    global_vols = global_vols.assign(account_id=map_account_ids(global_vols['exchange_name'], exchange_map['Global']))
+    global_vols = global_vols[global_vols['account_id'] >= 0]
+
+    # Convert the BTC volumes to USD with the as-of rate of each report date,
+    # and count the rows left without a recent enough rate
+    usd_amount = rate_table.convert(global_vols['report_date'], global_vols['btc_volume'],
+                                    BTC_CURRENCY_ID, USD_CURRENCY_ID, tolerance)
+    global_vols = global_vols.assign(usd_amount=usd_amount,
+                                     unconverted=usd_amount.isna() & global_vols['btc_volume'].notna())
+
+    # Create monthly period for aggregation
+    global_vols['month'] = month_start(global_vols['report_date'])
+    global_vols['exchange_type'] = replace_values(global_vols['exchange_type'], {'futures': 'future'})
+
+    # Aggregate volumes by month, account, and exchange type
+    # A group without any converted row has no global volume rather than zero
+    global_vols_grouped = global_vols.groupby(['month', 'account_id', 'exchange_type'], as_index=False, observed=True).agg(
+        usd_amount_global=('usd_amount', 'sum'), converted_rows=('usd_amount', 'count'), unconverted_rows=('unconverted', 'sum'))
+    global_vols_grouped['usd_amount_global'] = global_vols_grouped['usd_amount_global'].where(global_vols_grouped.pop('converted_rows') > 0)
+    return global_vols_grouped
+
+
+@profiled()
+def join_benchmark(account_months, global_months, exchange_map):
+    # Global vs 3Commas volumes per month, account_id and 3Commas account
+    # type, before the page filters, from the monthly totals of both sides.
+    # Both sides are summed over their exchange types first, so a 3Commas
+    # row is never repeated for every global row of its account_id or the
+    # other way round. A global total is still repeated for every account
+    # type mapped to its account_id, summarize_benchmark counts it once.
+    t_commas = account_months.assign(account_id=map_account_ids(account_months['account_type'], exchange_map['3commas']))
+    t_commas = t_commas[t_commas['account_id'] >= 0]
+    t_commas_grouped = t_commas.groupby(['month', 'account_id', 'account_type'], as_index=False, observed=True).agg({'usd_amount': 'sum'})
+    t_commas_grouped.rename(columns={'usd_amount': 'usd_amount_3commas'}, inplace=True)
+
+    # A month without any converted row of an account has no global volume
+    global_grouped = global_months.groupby(['month', 'account_id'], as_index=False).agg(
+        usd_amount_global=('usd_amount_global', 'sum'), converted=('usd_amount_global', 'count'),
+        unconverted_rows=('unconverted_rows', 'sum'))
+    global_grouped['usd_amount_global'] = global_grouped['usd_amount_global'].where(global_grouped.pop('converted') > 0)
+
+    # Merge global and 3Commas volumes for comparison, keeping the global
+    # exchanges that have a 3Commas counterpart
+    benchmark = global_grouped.merge(t_commas_grouped, on=['month', 'account_id'])
+    return benchmark.reset_index(drop=True)
+
+
+# Global vs 3Commas volumes per month and account, before the page filters
+@profiled()
+def build_benchmark(account_months, global_vols, rate_table, exchange_map, tolerance=DEFAULT_TOLERANCE):
+    return join_benchmark(account_months, aggregate_global_months(global_vols, rate_table, exchange_map, tolerance),
+                          exchange_map)
+
+
+@profiled()
+def summarize_benchmark(benchmark, months, account_types):
+    # Monthly global and 3Commas volumes of the selected months and account
+    # types, and the global rows of each month left without a BTC rate
+    filtered = benchmark[benchmark['month'].isin(months) & benchmark['account_type'].isin(account_types)]
+    # Global totals are repeated for every account type of an account_id, count each one once
+    global_ = filtered.drop_duplicates(['month', 'account_id']).groupby('month')
+    unconverted = global_['unconverted_rows'].sum()
+    # Months without any converted global volume stay gaps rather than zeros
+    monthly = pd.concat([global_['usd_amount_global'].sum(min_count=1),
+                         filtered.groupby('month')['usd_amount_3commas'].sum(min_count=1)], axis=1).reset_index()
+    return monthly, unconverted[unconverted > 0]
@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+# Fast-render mode of the charts, on unless DASHBOARD_FAST_RENDER=0. Series
+# longer than MAX_POINTS are downsampled, and series longer than
+# WEBGL_POINTS are drawn as WebGL traces with their labels moved to the
+# hover. Shorter series render exactly as before.
+FAST_RENDER = os.environ.get('DASHBOARD_FAST_RENDER', '1') not in ('', '0')
+MAX_POINTS = int(os.environ.get('DASHBOARD_MAX_POINTS', '2000'))
+WEBGL_POINTS = int(os.environ.get('DASHBOARD_WEBGL_POINTS', '1000'))
+
+# Style shared by every chart, built once. Set titles with title_text to
+# keep the title font.
+FONT_FAMILY = "Helvetica, Arial, sans-serif"
+BASE_LAYOUT = go.Layout(
+    font=dict(family=FONT_FAMILY, size=14, color="#333"),
+    title_font=dict(family=FONT_FAMILY, size=18, color="#00B0A3"),
+    legend=dict(font=dict(family=FONT_FAMILY, size=12, color="#333")),
+)
+
+# Suffix and divisor of format_number's ranges, largest first
+_SCALES = [(1e12, 'T'), (1e9, 'B'), (1e6, 'M'), (1e3, 'K')]
+
+
+def format_numbers(values):
+    # format_number of a whole array: the ranges are picked with array masks
+    # and the labels built in a single pass
+    values = np.asarray(values)
+    with np.errstate(invalid='ignore'):
+        ranges = [np.abs(values) >= divisor for divisor, _ in _SCALES]
+    divisors = np.select(ranges, [divisor for divisor, _ in _SCALES], 1.0)
+    suffixes = np.select(ranges, [suffix for _, suffix in _SCALES], '')
+    return np.array([f'{scaled:.1f}{suffix}' if suffix else str(value) for value, scaled, suffix
+                     in zip(values.tolist(), (values / divisors).tolist(), suffixes.tolist())], dtype=object)
+
+
+def lttb(x, y, threshold):
+    # Positions of the points kept by Largest-Triangle-Three-Buckets: the
+    # first and last points, and in each bucket between them the point
+    # forming the largest triangle with the point kept in the previous bucket
+    # and the mean of the next bucket. Peaks and troughs survive.
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype('int64')
+    kept = np.empty(threshold, dtype='int64')
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        mean_x = x[stop:next_stop].mean()
+        mean_y = y[stop:next_stop].mean()
+        areas = np.abs((x[a] - mean_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (mean_y - y[a]))
+        a = start + int(np.nanargmax(areas)) if np.isfinite(areas).any() else start
+        kept[i + 1] = a
+    return kept
+
+
+def _numeric(x):
+    x = pd.Series(x)
+    if pd.api.types.is_datetime64_any_dtype(x):
+        return x.to_numpy().astype('datetime64[ns]').astype('int64')
+    if pd.api.types.is_numeric_dtype(x):
+        return x.to_numpy()
+    return np.arange(len(x))
+
+
+def scatter(x, y, text=None, mode='lines+markers', **kwargs):
+    # Scatter trace of a series. In fast-render mode a long series is
+    # downsampled with lttb and drawn with WebGL, its labels shown on hover
+    # instead of next to every point.
+    x, y = np.asarray(x), np.asarray(y)
+    trace = go.Scatter
+    if FAST_RENDER and len(y) > MAX_POINTS:
+        kept = lttb(_numeric(x), y, MAX_POINTS)
+        x, y = x[kept], y[kept]
+        text = None if text is None else np.asarray(text)[kept]
+    if FAST_RENDER and len(y) > WEBGL_POINTS:
+        trace = go.Scattergl
+        mode = mode.replace('+text', '')
+    return trace(x=x, y=y, text=text, mode=mode, **kwargs)
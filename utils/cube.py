@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+
+from utils.funcs import ATTRIBUTE_COLUMNS
+from utils.profiling import profiled
+from utils.result_cache import canonical_key
+from utils.sketches import ACCURACY, bucket_codes, sketch_counts, sketch_quantiles
+
+# Dimensions of a cube cell besides the month
+CELL_COLUMNS = ['user_segment'] + ATTRIBUTE_COLUMNS
+
+
+def _ranges(start, stop):
+    # Positions of the concatenated [start, stop) ranges without a Python loop
+    lengths = stop - start
+    offsets = np.repeat(start - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(lengths.sum())
+
+
+class FilterCube:
+    # Pre-aggregated month x segment x descriptor cells of the volume data.
+    #
+    # Each cell holds additive measures of its raw rows (volume, rows) and
+    # the sorted positions of its distinct user-months in the per user-month
+    # arrays, a sparse bitmap stored as one contiguous range of a shared
+    # array. A filter selects cells, and OR-ing their bitmaps gives exact
+    # distinct trader counts even when a user-month falls in several
+    # selected cells. The per user-month volume totals are kept aside so the
+    # average volume per trader stays exact as well, along with their
+    # quantile sketch buckets for the volume quantiles.
+
+    @profiled('FilterCube')
+    def __init__(self, user_month_attrs, df_monthly):
+        self.months = np.sort(df_monthly['month'].unique())
+        self.user_ids = np.sort(df_monthly['user_id'].unique())
+        self.segments = df_monthly['user_segment'].cat.categories
+        n_users = len(self.user_ids)
+
+        # User-month keys of df_monthly with their volume, segment and
+        # (month, user_segment) group
+        um_keys = (np.searchsorted(self.months, df_monthly['month'].to_numpy()).astype('int64') * n_users
+                   + np.searchsorted(self.user_ids, df_monthly['user_id'].to_numpy()))
+        order = np.argsort(um_keys, kind='stable')
+        self._um_keys = um_keys[order]
+        self._um_volume = df_monthly['usd_amount'].to_numpy()[order]
+        self._um_segment = df_monthly['user_segment'].cat.codes.to_numpy()[order]
+        self._um_bucket = bucket_codes(self._um_volume)
+        self._um_group = (self._um_keys // n_users) * len(self.segments) + self._um_segment
+
+        # Key every attribute row by its user-month to find its segment. The
+        # rows are in no particular order, hashing them into the sorted arrays
+        # is faster than binary searches at random positions.
+        attrs = user_month_attrs
+        month_codes = np.searchsorted(self.months, attrs['month'].to_numpy())
+        user_codes = pd.Index(self.user_ids).get_indexer(attrs['user_id'].to_numpy())
+        row_keys = month_codes.astype('int64') * n_users + user_codes
+        um_positions = pd.Index(self._um_keys).get_indexer(row_keys)
+        segment_codes = self._um_segment[um_positions]
+
+        rows = pd.DataFrame({'month': month_codes, 'um_position': um_positions})
+        rows['user_segment'] = pd.Categorical.from_codes(segment_codes, self.segments)
+        # .array keeps the descriptors categorical, to_numpy would turn them
+        # into object arrays of strings that are slow to sort and group
+        for column in ATTRIBUTE_COLUMNS + ['volume', 'rows']:
+            rows[column] = attrs[column].array
+
+        # Attribute rows are distinct per cell and user, sorting them makes
+        # the user-months of every cell contiguous. Unsegmented user-months
+        # belong to no cell, a missing attribute is a cell value of its own.
+        rows = rows.dropna(subset=['user_segment']).sort_values(['month'] + CELL_COLUMNS + ['um_position'], ignore_index=True)
+        self._cell_positions = rows['um_position'].to_numpy()
+
+        cells = rows.groupby(['month'] + CELL_COLUMNS, observed=True, sort=True, dropna=False).agg(
+            volume=('volume', 'sum'), rows=('rows', 'sum'), users=('um_position', 'size')).reset_index()
+        cells['stop'] = cells['users'].cumsum()
+        cells['start'] = cells['stop'] - cells['users']
+        self.cells = cells
+
+        # Measures of every user-month of each group, the selection of any
+        # filter that keeps every cell
+        self._totals = self._merge(np.ones(len(cells), dtype=bool))
+        self._last = None
+
+    def __len__(self):
+        return len(self.cells)
+
+    def _merge(self, mask):
+        # Distinct users, summed monthly volume and sketch bucket counts per
+        # (month, user_segment) of the user-months of the cells in mask
+        cells = self.cells[mask]
+        bitmap = np.zeros(len(self._um_keys), dtype=bool)
+        bitmap[self._cell_positions[_ranges(cells['start'].to_numpy(), cells['stop'].to_numpy())]] = True
+        found = np.flatnonzero(bitmap)
+        groups = self._um_group[found]
+        size = len(self.months) * len(self.segments)
+        return (np.bincount(groups, minlength=size), np.bincount(groups, weights=self._um_volume[found], minlength=size),
+                sketch_counts(groups, self._um_bucket[found], size))
+
+    def _select(self, segments, filters):
+        # Cells in the chosen segments matching every attribute filter, and
+        # the measures per (month, user_segment) of their distinct user-months.
+        # The page asks for the measures and the quantiles of the same
+        # selection in a row, so the last one is kept.
+        key = canonical_key(None, segments=segments, filters=filters)
+        last = self._last
+        if last is not None and last[0] == key:
+            return last[1]
+
+        cells = self.cells
+        mask = np.ones(len(cells), dtype=bool)
+        for column, values in filters.items():
+            mask &= cells[column].isin(values).to_numpy()
+        # Filters keeping every cell select every user-month of a group
+        users, usd_amount, counts = self._totals if mask.all() else self._merge(mask)
+        chosen = np.tile(self.segments.isin(segments), len(self.months))
+        selection = (cells[mask & cells['user_segment'].isin(segments).to_numpy()],
+                     users * chosen, usd_amount * chosen, counts * chosen[:, None])
+        self._last = (key, selection)
+        return selection
+
+    def _index(self):
+        return pd.MultiIndex.from_product([pd.DatetimeIndex(self.months, name='month'),
+                                           pd.Index(self.segments, name='user_segment')])
+
+    @profiled('FilterCube.query')
+    def query(self, segments, filters):
+        # Per (month, user_segment) measures of the user-months in the chosen
+        # segments with at least one row matching every attribute filter:
+        # users (distinct traders), usd_amount (sum of their monthly totals),
+        # volume and rows (additive measures of the matching raw rows)
+        selected, users, usd_amount, _ = self._select(segments, filters)
+        n_segments = len(self.segments)
+        size = len(self.months) * n_segments
+        cell_groups = selected['month'].to_numpy() * n_segments + selected['user_segment'].cat.codes.to_numpy()
+        volume = np.bincount(cell_groups, weights=selected['volume'].to_numpy(), minlength=size)
+        rows = np.bincount(cell_groups, weights=selected['rows'].to_numpy(), minlength=size)
+
+        result = pd.DataFrame({'users': users, 'usd_amount': usd_amount, 'volume': volume,
+                               'rows': rows.astype('int64')}, index=self._index())
+        return result[result['users'] > 0]
+
+    @profiled('FilterCube.quantiles')
+    def quantiles(self, segments, filters, quantiles=(0.5, 0.9, 0.99)):
+        # Quantiles of the monthly volume of the users counted by query, per
+        # (month, user_segment), within the relative accuracy of the sketches.
+        # The sketches of the selected user-months are merged by counting their
+        # buckets, so a user-month in several cells is counted once.
+        counts = self._select(segments, filters)[3]
+        result = pd.DataFrame(sketch_quantiles(counts, quantiles, ACCURACY), index=self._index(),
+                              columns=[f'p{q * 100:g}' for q in quantiles])
+        return result[counts.sum(axis=1) > 0]
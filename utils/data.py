@@ -0,0 +1,469 @@
+import os
+import json
+import pickle
+import tempfile
+import streamlit as st
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from utils.funcs import preprocess_data, build_user_month_attributes, aggregate_account_months
+from utils.benchmark import build_benchmark
+from utils.exchanges import build_exchange_map, exchange_match_report
+from utils.rates import RateTable, TOLERANCE_DAYS
+from utils.streaming import preprocess_chunks
+from utils.user_index import UserIndex
+from utils.cube import FilterCube
+from utils.migration import SegmentMigration
+from utils.sketches import ACCURACY, LEADERBOARD_SIZE, Leaderboards
+from utils.profiling import profiled
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # Fall back to reading the CSV files directly
+    pa = None
+
+# Location of the input files
+DATA_DIR = Path(__file__).parent.parent / 'data'
+COMMAS_PATH = DATA_DIR / '3Commas Volumes.csv'
+GLOBAL_PATH = DATA_DIR / 'Exchange Volumes.csv'
+RATES_PATH = DATA_DIR / 'Currency Rates.csv'
+ACCOUNT_IDS_PATH = DATA_DIR / 'account_ids.csv'
+INPUT_PATHS = [COMMAS_PATH, GLOBAL_PATH, RATES_PATH, ACCOUNT_IDS_PATH]
+
+# Typed columnar copies of the input files are written here
+CACHE_DIR = DATA_DIR / '.cache'
+
+# Persisted aggregates, one parquet file per month in each table
+STORE_DIR = DATA_DIR / 'store'
+MANIFEST_NAME = 'manifest.json'
+# Version of the layout of the store tables and of the structures pickled
+# with them, a store of an older one is not read
+STORE_FORMAT = 3
+AGGREGATE_TABLES = ['user_months', 'user_month_attributes', 'account_months']
+# Structures the pages build from the aggregate tables, precomputed by
+# main.py and pickled in the store
+DERIVED_DIR = 'derived'
+
+# Float type of the volume columns. float32 halves their memory and keeps
+# about 7 significant digits, the rates always stay float64.
+FLOAT_DTYPE = os.environ.get('DASHBOARD_FLOAT_DTYPE', 'float64')
+
+# Column types of each input file: ids are read as int32 and strings as
+# categoricals, the other columns keep the types inferred by the reader
+SCHEMAS = {
+    COMMAS_PATH.name: {
+        'dates': ['month'],
+        'categories': ['account_type', 'exchange_type', 'subscription', 'subscription_type'],
+        'integers': ['user_id'],
+        'floats': ['usd_amount'],
+    },
+    GLOBAL_PATH.name: {
+        'dates': ['report_date'],
+        'categories': ['exchange_name', 'exchange_type'],
+        'integers': [],
+        'floats': ['btc_volume'],
+    },
+    RATES_PATH.name: {
+        'dates': ['date'],
+        'categories': [],
+        'integers': ['from_currency_id', 'to_currency_id'],
+        'floats': [],
+    },
+}
+
+# Query backend of the pages: pandas, or duckdb to query the parquet copies
+# of the input files in SQL. Without duckdb or pyarrow the pages use pandas.
+BACKEND = os.environ.get('DASHBOARD_BACKEND', 'pandas')
+
+# Rows per chunk of the streaming preprocessing. When set, the raw volumes
+# are never loaded whole and the pages only read the aggregate tables.
+CHUNKSIZE = int(os.environ.get('DASHBOARD_CHUNKSIZE', '0')) or None
+
+
+def file_signature(path):
+    # Modification time and size identify the version of a data file, a change
+    # in either one invalidates every cached frame built from it
+    stat = Path(path).stat()
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _parquet_path(path):
+    return CACHE_DIR / (Path(path).stem + '.parquet')
+
+
+# Version of the layout of the parquet copies, copies of an older one are stale
+COPY_FORMAT = 2
+
+
+def _signature_key(signature):
+    # Copies written with another float type are stale too
+    return ','.join(str(x) for x in signature + (FLOAT_DTYPE, COPY_FORMAT)).encode()
+
+
+@profiled()
+def convert_to_parquet(path):
+    # Stream the CSV into a typed parquet copy batch by batch, so converting a
+    # file never holds more than one block of it in memory. The source
+    # signature is stored in the file metadata to detect stale copies.
+    schema = SCHEMAS[Path(path).name]
+    column_types = {col: pa.timestamp('ns') for col in schema['dates']}
+    column_types.update({col: pa.dictionary(pa.int32(), pa.string()) for col in schema['categories']})
+    column_types.update({col: pa.int32() for col in schema['integers']})
+    column_types.update({col: pa.from_numpy_dtype(np.dtype(FLOAT_DTYPE)) for col in schema['floats']})
+    # Empty and NA fields are missing values, as with pd.read_csv
+    convert_options = pa_csv.ConvertOptions(column_types=column_types, strings_can_be_null=True)
+    reader = pa_csv.open_csv(path, convert_options=convert_options)
+
+    metadata = dict(reader.schema.metadata or {})
+    metadata[b'source_signature'] = _signature_key(file_signature(path))
+    out_schema = reader.schema.with_metadata(metadata)
+
+    parquet_path = _parquet_path(path)
+    parquet_path.parent.mkdir(parents=True, exist_ok=True)
+    # Each conversion writes its own temporary file, several threads or
+    # processes may convert the same input at once
+    with tempfile.NamedTemporaryFile(dir=parquet_path.parent, prefix=parquet_path.name + '.', suffix='.tmp',
+                                     delete=False) as tmp:
+        tmp_path = Path(tmp.name)
+    try:
+        with pq.ParquetWriter(tmp_path, out_schema) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+        # Other workers may be reading the previous copy, replace it atomically
+        os.replace(tmp_path, parquet_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return parquet_path
+
+
+def _is_fresh(parquet_path, signature):
+    if not parquet_path.exists():
+        return False
+    metadata = pq.read_schema(parquet_path).metadata or {}
+    return metadata.get(b'source_signature') == _signature_key(signature)
+
+
+def columnar_copy(path):
+    # Path of the up to date parquet copy of an input file
+    parquet_path = _parquet_path(path)
+    if not _is_fresh(parquet_path, file_signature(path)):
+        convert_to_parquet(path)
+    return parquet_path
+
+
+@profiled()
+def read_csv_typed(path, schema, columns=None, **kwargs):
+    # Read a CSV file straight into the column types of its schema
+    parse_dates = [c for c in schema['dates'] if columns is None or c in columns]
+    dtype = {c: 'category' for c in schema['categories']}
+    dtype.update({c: 'int32' for c in schema['integers']})
+    dtype.update({c: FLOAT_DTYPE for c in schema['floats']})
+    dtype = {c: t for c, t in dtype.items() if columns is None or c in columns}
+    return pd.read_csv(path, usecols=columns, parse_dates=parse_dates, dtype=dtype, **kwargs)
+
+
+@profiled()
+def read_dataset(path, columns=None):
+    # Read an input file through its columnar copy, converting it on first use
+    if pa is None:
+        return read_csv_typed(path, SCHEMAS[Path(path).name], columns)
+
+    return pd.read_parquet(columnar_copy(path), columns=columns)
+
+
+def iter_dataset_chunks(path, chunksize, columns=None):
+    # Read an input file in frames of at most chunksize rows
+    if pa is None:
+        with read_csv_typed(path, SCHEMAS[Path(path).name], columns, chunksize=chunksize) as reader:
+            yield from reader
+        return
+
+    # Batches end at the row groups of the copy, a few thousand rows each,
+    # they are gathered into frames of chunksize rows
+    table = None
+    for batch in pq.ParquetFile(columnar_copy(path)).iter_batches(batch_size=chunksize, columns=columns):
+        batch = pa.Table.from_batches([batch])
+        table = batch if table is None else pa.concat_tables([table, batch])
+        while table.num_rows >= chunksize:
+            yield table.slice(0, chunksize).to_pandas()
+            table = table.slice(chunksize)
+    if table is not None and table.num_rows:
+        yield table.to_pandas()
+
+
+def input_signatures():
+    # Signature of every input file present, keyed by file name
+    return {path.name: list(file_signature(path)) for path in INPUT_PATHS if path.exists()}
+
+
+def read_manifest(store_dir=STORE_DIR):
+    # Manifest written by main.py once the store holds a complete build
+    manifest_path = Path(store_dir) / MANIFEST_NAME
+    if not manifest_path.exists():
+        return None
+    return json.loads(manifest_path.read_text())
+
+
+@profiled()
+def load_store_table(table, store_dir=STORE_DIR, columns=None, months=None):
+    # The stored months of one table as a single frame, all of them unless
+    # months is given. The partitions are read as one dataset, so their
+    # categorical columns are unified.
+    table_dir = Path(store_dir) / table
+    if not any(table_dir.glob('*.parquet')):
+        return None
+    filters = None if months is None else [('month', 'in', [pd.Timestamp(month) for month in months])]
+    df = pd.read_parquet(table_dir, columns=columns, filters=filters)
+    return df.sort_values(['month'], kind='stable', ignore_index=True)
+
+
+def derived_settings():
+    # Settings the derived structures are built with, a structure pickled
+    # with other ones is built again by the pages
+    return {'sketch_accuracy': ACCURACY, 'leaderboard_size': LEADERBOARD_SIZE}
+
+
+def derived_path(name, store_dir=STORE_DIR):
+    return Path(store_dir) / DERIVED_DIR / f"{name}.pickle"
+
+
+@profiled()
+def load_derived(name, store_dir=STORE_DIR):
+    # A structure pickled in the store by main.py, None when it is missing
+    # or was built with other settings
+    path = derived_path(name, store_dir)
+    if not path.exists():
+        return None
+    with path.open('rb') as f:
+        settings, value = pickle.load(f)
+    return value if settings == derived_settings() else None
+
+
+def _store_version(paths):
+    # Build time of the store when it was built from the current version of
+    # the given inputs. Inputs that are missing, or that the build did not
+    # read because the store was fed by incremental ingests, count as
+    # current. None means the aggregates must be computed from the inputs.
+    manifest = read_manifest()
+    if manifest is None or manifest.get('format') != STORE_FORMAT:
+        return None
+    signatures = manifest['signatures']
+    for path in paths:
+        if path.exists() and path.name in signatures and signatures[path.name] != list(file_signature(path)):
+            return None
+    return ('store', manifest['built_at'])
+
+
+def _source_aggregates_version():
+    return ('source', file_signature(COMMAS_PATH), CHUNKSIZE)
+
+
+def _source_benchmark_version():
+    return ('source', aggregates_version(), file_signature(GLOBAL_PATH), file_signature(RATES_PATH),
+            file_signature(ACCOUNT_IDS_PATH), TOLERANCE_DAYS)
+
+
+def aggregates_version():
+    # Version of the aggregate tables, part of the key of every result built from them
+    return _store_version([COMMAS_PATH]) or _source_aggregates_version()
+
+
+def benchmark_version():
+    # Version of the benchmark table, likewise. A store converted with
+    # another rate tolerance than DASHBOARD_RATE_TOLERANCE_DAYS is stale.
+    manifest = read_manifest() or {}
+    if manifest.get('rate_tolerance_days') != TOLERANCE_DAYS:
+        return _source_benchmark_version()
+    return _store_version(INPUT_PATHS) or _source_benchmark_version()
+
+
+# The cached frames are shared by every page and session of the process, so
+# callers must treat them as read-only and build new frames instead of
+# assigning columns in place. Entries are keyed by the file signature or the
+# store build, so a stale version is evicted as soon as a newer one is loaded.
+@st.cache_resource(show_spinner='Loading 3Commas volumes...', max_entries=1)
+@profiled('load_commas_volumes')
+def _load_commas_volumes(path, signature):
+    return preprocess_data(read_dataset(path))
+
+
+@st.cache_resource(show_spinner='Aggregating 3Commas volumes...', max_entries=1)
+@profiled('load_aggregates')
+def _load_aggregates(version):
+    # The tables of aggregate_tables, read from the store built by main.py,
+    # streamed chunk by chunk when a chunk size is set, and derived from the
+    # cached raw rows otherwise
+    if version[0] == 'store':
+        tables = {table: load_store_table(table) for table in AGGREGATE_TABLES}
+        if all(frame is not None for frame in tables.values()):
+            return tables
+        # A table missing from the store is computed from the source
+        version = _source_aggregates_version()
+    _, signature, chunksize = version
+    if chunksize:
+        return preprocess_chunks(iter_dataset_chunks(COMMAS_PATH, chunksize), chunksize)
+    df, df_monthly = _load_commas_volumes(str(COMMAS_PATH), signature)
+    return {
+        'user_months': df_monthly,
+        'user_month_attributes': build_user_month_attributes(df),
+        'account_months': aggregate_account_months(df),
+    }
+
+
+@st.cache_resource(show_spinner='Indexing users...', max_entries=1)
+@profiled('load_user_index')
+def _load_user_index(version):
+    tables = _load_aggregates(version)
+    if version[0] == 'store':
+        # Pickled without the tables it indexes, the stored ones
+        index = load_derived('user_index')
+        if index is not None and index.attach(tables['user_month_attributes'], tables['user_months']):
+            return index
+    return UserIndex(tables['user_month_attributes'], tables['user_months'])
+
+
+@st.cache_resource(show_spinner='Building filter cube...', max_entries=1)
+@profiled('load_filter_cube')
+def _load_filter_cube(version):
+    # Precomputed by main.py when the version is a store build
+    if version[0] == 'store':
+        cube = load_derived('filter_cube')
+        if cube is not None:
+            return cube
+    tables = _load_aggregates(version)
+    return FilterCube(tables['user_month_attributes'], tables['user_months'])
+
+
+@st.cache_resource(show_spinner='Ranking traders...', max_entries=1)
+@profiled('load_leaderboards')
+def _load_leaderboards(version):
+    if version[0] == 'store':
+        leaderboards = load_derived('leaderboards')
+        if leaderboards is not None:
+            return leaderboards
+    return Leaderboards(_load_aggregates(version)['user_month_attributes'])
+
+
+@st.cache_resource(show_spinner='Tracking segment migration...', max_entries=1)
+@profiled('load_segment_migration')
+def _load_segment_migration(version):
+    if version[0] == 'store':
+        migration = load_derived('segment_migration')
+        if migration is not None:
+            return migration
+    return SegmentMigration(_load_aggregates(version)['user_months'])
+
+
+@st.cache_resource(show_spinner='Benchmarking volumes...', max_entries=1)
+@profiled('load_benchmark')
+def _load_benchmark(version):
+    if version[0] == 'store':
+        benchmark = load_store_table('benchmark')
+        if benchmark is not None:
+            return benchmark
+        version = _source_benchmark_version()
+    return build_benchmark(_load_aggregates(version[1])['account_months'], load_exchange_volumes(),
+                           load_rate_table(), load_exchange_map())
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+@profiled('load_rate_table')
+def _load_rate_table(path, signature):
+    return RateTable(read_dataset(path))
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+@profiled('load_exchange_map')
+def _load_exchange_map(path, signature):
+    return build_exchange_map(pd.read_csv(path))
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+@profiled('load_exchange_report')
+def _load_exchange_report(version):
+    account_months = None
+    if version[0] == 'store':
+        account_months = load_store_table('account_months', columns=['month', 'account_type'])
+    if account_months is None:
+        account_months = _load_aggregates(aggregates_version())['account_months']
+    account_types = account_months['account_type']
+    exchange_names = load_exchange_volumes()['exchange_name']
+    return exchange_match_report(account_types, exchange_names, load_exchange_map())
+
+
+@st.cache_resource(show_spinner='Opening the SQL backend...', max_entries=1)
+@profiled('load_sql_backend')
+def _load_sql_backend(signatures):
+    from utils import sql_backend
+    return sql_backend.SqlBackend(columnar_copy(COMMAS_PATH), columnar_copy(GLOBAL_PATH), columnar_copy(RATES_PATH),
+                                  load_exchange_map())
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+@profiled('load_dataset')
+def _load_dataset(path, signature):
+    return read_dataset(path)
+
+
+def load_aggregates():
+    # user_months, user_month_attributes and account_months tables
+    return _load_aggregates(aggregates_version())
+
+
+def load_user_index():
+    # Per-user row ranges for single user lookups, see UserIndex
+    return _load_user_index(aggregates_version())
+
+
+def load_filter_cube():
+    # Month x segment x descriptor aggregates for the segment filters, see FilterCube
+    return _load_filter_cube(aggregates_version())
+
+
+def load_leaderboards():
+    # Top traders of every month and account type, see Leaderboards
+    return _load_leaderboards(aggregates_version())
+
+
+def load_segment_migration():
+    # Segment transitions, streaks and per-user metrics, see SegmentMigration
+    return _load_segment_migration(aggregates_version())
+
+
+def load_benchmark():
+    # Global and 3Commas volumes per month and account, see build_benchmark
+    return _load_benchmark(benchmark_version())
+
+
+def load_rate_table():
+    # Sorted per-pair currency rates for as-of conversions, see RateTable
+    return _load_rate_table(str(RATES_PATH), file_signature(RATES_PATH))
+
+
+def load_exchange_map():
+    # Resolved name -> account_id lookups of account_ids.csv, see build_exchange_map
+    return _load_exchange_map(str(ACCOUNT_IDS_PATH), file_signature(ACCOUNT_IDS_PATH))
+
+
+def load_exchange_report():
+    # Exchange names the benchmark could not match, see exchange_match_report
+    return _load_exchange_report(benchmark_version())
+
+
+def load_sql_backend():
+    # DuckDB backend of the page queries when selected, see SqlBackend. None
+    # means the pages use the pandas path.
+    if BACKEND != 'duckdb' or pa is None:
+        return None
+    # Imported only when selected, duckdb is slow to import
+    from utils import sql_backend
+    if sql_backend.duckdb is None:
+        return None
+    return _load_sql_backend((tuple(input_signatures().items()), FLOAT_DTYPE))
+
+
+def load_exchange_volumes():
+    return _load_dataset(str(GLOBAL_PATH), file_signature(GLOBAL_PATH))
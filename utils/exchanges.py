@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+from utils.funcs import ACCOUNT_TYPE_REPLACEMENTS, replace_values
+from utils.profiling import profiled
+
+# Columns of data/account_ids.csv
+ACCOUNT_ID_COLUMNS = ['3commas', 'Global', 'account_id']
+
+
+def normalize_names(names):
+    return pd.Index(names).astype(str).str.lower().str.strip()
+
+
+def _resolve(names, account_ids):
+    # Unique name -> account_id table, and the names mapped to several ids
+    pairs = pd.DataFrame({'name': normalize_names(names), 'account_id': account_ids}).drop_duplicates()
+    counts = pairs['name'].value_counts()
+    ambiguous = pairs[pairs['name'].isin(counts.index[counts > 1])]
+    resolved = pairs[~pairs['name'].isin(ambiguous['name'])]
+    return pd.Series(resolved['account_id'].to_numpy(), index=resolved['name'].to_numpy()), ambiguous
+
+
+@profiled()
+def build_exchange_map(account_ids):
+    # Resolve account_ids.csv once into name -> account_id lookups for both
+    # sides of the benchmark. The 3Commas names get the same cleaning as the
+    # account_type column, so 'CoinbaseAdvanced' matches what preprocessing
+    # leaves of it. Names mapped to more than one account_id are ambiguous,
+    # they are reported and left unmapped instead of duplicating rows.
+    missing = [c for c in ACCOUNT_ID_COLUMNS if c not in account_ids.columns]
+    if missing:
+        raise ValueError(f"account_ids is missing columns: {missing}")
+    if account_ids['account_id'].isna().any() or not pd.api.types.is_integer_dtype(account_ids['account_id']):
+        raise ValueError("account_ids has missing or non-integer account_id values")
+
+    commas_names = replace_values(account_ids['3commas'].astype('category'), ACCOUNT_TYPE_REPLACEMENTS)
+    commas, commas_ambiguous = _resolve(commas_names, account_ids['account_id'])
+    global_, global_ambiguous = _resolve(account_ids['Global'], account_ids['account_id'])
+    ambiguous = pd.concat([commas_ambiguous.assign(side='3commas'), global_ambiguous.assign(side='Global')],
+                          ignore_index=True)
+    return {'3commas': commas, 'Global': global_, 'ambiguous': ambiguous}
+
+
+def map_account_ids(names, mapping):
+    # int32 account_id of every name, -1 where unmapped. Categorical columns
+    # are mapped through their categories only.
+    names = pd.Series(names)
+    if not isinstance(names.dtype, pd.CategoricalDtype):
+        names = names.astype('category')
+    lookup = mapping.reindex(normalize_names(names.cat.categories)).fillna(-1).to_numpy(dtype='int32')
+    codes = names.cat.codes.to_numpy()
+    return pd.Series(np.where(codes >= 0, lookup[codes], -1), index=names.index)
+
+
+def unmatched_names(names, mapping):
+    # Distinct names with no account_id
+    names = pd.Index(pd.Series(names).dropna().unique())
+    return sorted(names[~normalize_names(names).isin(mapping.index)].astype(str))
+
+
+def exchange_match_report(account_types, exchange_names, exchange_map):
+    # Names the benchmark cannot use: 3Commas account types and global
+    # exchanges without an account_id, and ambiguous rows of account_ids.csv
+    return {
+        'unmatched_3commas': unmatched_names(account_types, exchange_map['3commas']),
+        'unmatched_global': unmatched_names(exchange_names, exchange_map['Global']),
+        'ambiguous': exchange_map['ambiguous'],
+    }
@@ -1,81 +1,110 @@
-import streamlit as st
-from pathlib import Path
 import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
-import plotly.express as px
-import re
-from PIL import Image
 
-def load_logo():
-    # Load the dataset
-    path = Path(__file__).parent.parent
-    logo_path = path / 'img/logo.png'
-    image = Image.open(logo_path)
-
-    st.logo(image, size="large", link=None, icon_image=None)
-    return None
-
-
-# Preprocessing function
-def preprocess_data(df):
+from utils.segments import segment_volumes
+from utils.charts import BASE_LAYOUT, format_numbers
+from utils.profiling import profiled
+
+def contains(s, pat):
+    # str.contains that only scans the categories of a categorical column
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        matches = np.asarray(s.cat.categories.str.lower().str.contains(pat), dtype=bool)
+        codes = s.cat.codes.to_numpy()
+        return pd.Series((codes >= 0) & matches[codes], index=s.index)
+    return s.str.lower().str.contains(pat)
+
+
+def replace_values(s, to_replace):
+    # Regex replace that only rewrites the categories of a categorical column.
+    # Several categories can collapse into one, so the codes are remapped.
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        renamed = s.cat.categories.to_series().replace(to_replace, regex=True)
+        mapping, categories = pd.factorize(renamed)
+        codes = s.cat.codes.to_numpy()
+        codes = np.where(codes >= 0, mapping[codes], -1)
+        return pd.Series(pd.Categorical.from_codes(codes, categories), index=s.index, name=s.name).cat.remove_unused_categories()
+    return s.replace(to_replace, regex=True)
+
+
+def month_start(s):
+    # Truncate datetimes to the first day of their month, as pd.Grouper(freq='MS') does
+    return s.dt.to_period('M').dt.start_time.astype(s.dtype)
+
+# Patterns removed from account_type by the preprocessing
+ACCOUNT_TYPE_REPLACEMENTS = {'Account::': '', 'Accounts::': '', 'Account': '','Coin':''}
+
+# Cleaning step of the preprocessing
+@profiled()
+def clean_volumes(df):
     # Filter out paper exchanges
-    df = df[~df['account_type'].str.lower().str.contains("paper")]
+    df = df[~contains(df['account_type'], "paper")]
 
     # Remove 'Account::' and ' Account' from account_type
-    df['account_type'] = df['account_type'].replace({'Account::': '', 'Accounts::': '', 'Account': '','Coin':''}, regex=True)
+    df = df.assign(account_type=replace_values(df['account_type'], ACCOUNT_TYPE_REPLACEMENTS))
 
     # Convert the month column to datetime format
     df['month'] = pd.to_datetime(df['month'])
+    return df
 
-
-    # Define the volume categories
-    def categorize_user(volume):
-        if volume >= 2000000:
-            return 'A'
-        elif volume >= 200000:
-            return 'B'
-        elif volume >= 20000:
-            return 'C'
-        elif volume >= 1:
-            return 'D'
-        else:
-            return None
-
+@profiled()
+def aggregate_user_months(df):
     # Aggregate data to get total usd_amount per user per month
     df_monthly = df.groupby(['user_id', pd.Grouper(key='month', freq='MS')], as_index=False).agg({'usd_amount': 'sum'})
 
-    # Apply user category using aggregated usd_amount
-    df_monthly['user_segment'] = df_monthly['usd_amount'].apply(categorize_user)
+    # Segment users by their aggregated monthly usd_amount
+    df_monthly['user_segment'] = segment_volumes(df_monthly['usd_amount'])
+    return df_monthly
 
-    return df, df_monthly
-
-def clean_accounts(commas_vols,global_vols):
-    exchanges_names = global_vols.exchange_name.unique()
-    exchanges_names = [x.lower().strip() for x in exchanges_names]
-
-    commas_exchanges = commas_vols.account_type.unique()
-    commas_exchanges = [x.lower().strip() for x in commas_exchanges]
-    available_exchanges = [x for x in exchanges_names if any(c in x or x in c for c in commas_exchanges)]
-
-    pattern = '|'.join([re.escape(exchange.lower()) for exchange in available_exchanges])
-
-    # Use Boolean indexing with str.contains()
-    global_exchnges = global_vols[global_vols['exchange_name'].str.lower().str.contains(pattern, na=False)].reset_index()
-    return global_exchnges
+@profiled()
+def aggregate_account_months(df):
+    # Total usd_amount per month, account type and exchange type, the 3Commas
+    # side of the volume benchmark
+    df = df.assign(month=month_start(df['month']))
+    return df.groupby(['month', 'account_type', 'exchange_type'], as_index=False, observed=True).agg({'usd_amount': 'sum'})
 
+# Preprocessing function
+@profiled()
+def preprocess_data(df):
+    df = clean_volumes(df)
+    return df, aggregate_user_months(df)
+
+
+# Descriptor columns of a raw volume row
+ATTRIBUTE_COLUMNS = ['account_type', 'exchange_type', 'subscription', 'subscription_type']
+
+@profiled()
+def build_user_month_attributes(df):
+    # Distinct descriptor combinations of each user-month, keyed on
+    # (user_id, month) like df_monthly so joining the two stays linear.
+    # volume and rows are the additive measures of the raw rows of each one.
+    df = df.assign(month=month_start(df['month']))
+    return df.groupby(['user_id', 'month'] + ATTRIBUTE_COLUMNS, as_index=False, observed=True, sort=False, dropna=False).agg(
+        volume=('usd_amount', 'sum'), rows=('usd_amount', 'size'))
+
+@profiled()
+def aggregate_tables(df):
+    # Every aggregate the dashboard reads, built from cleaned volume rows
+    return {
+        'user_months': aggregate_user_months(df),
+        'user_month_attributes': build_user_month_attributes(df),
+        'account_months': aggregate_account_months(df),
+    }
 
 # Function to create stacked bar chart
 custom_colors = ['#00B0A3', '#6E9FFF', '#5CC8A1', '#FF708D']
+@profiled()
 def create_stacked_bar_chart(data, title, yaxis_title,percent=False):
-    fig = go.Figure()
+    fig = go.Figure(layout=BASE_LAYOUT)
+    months = data.index.strftime('%b %Y')
     for i, segment in enumerate(sorted(data.columns,reverse=True)):
 
         if percent:
             text=data[segment].round(1).astype(str)+'%'
         else:
-            text=data[segment].round(1).apply(format_number)
+            text=format_numbers(data[segment].round(1))
         fig.add_trace(go.Bar(
-            x=data.index.strftime('%b %Y'),
+            x=months,
             y=data[segment],
             text=text,
             name=f'Segment {segment}',
@@ -90,24 +119,7 @@ def create_stacked_bar_chart(data, title, yaxis_title,percent=False):
         barmode='stack',
         xaxis_title='Month',
         yaxis_title=yaxis_title,
-        title=title,
-        font=dict(
-            family="Helvetica, Arial, sans-serif",
-            size=14,
-            color="#333"
-        ),
-        title_font=dict(
-            family="Helvetica, Arial, sans-serif",
-            size=18,
-            color="#00B0A3"
-        ),
-        legend=dict(
-            font=dict(
-                family="Helvetica, Arial, sans-serif",
-                size=12,
-                color="#333"
-            )
-        )
+        title_text=title,
     )
     return fig
 
@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+
+from utils.profiling import profiled
+from utils.segments import DEFAULT_SCHEME, _labels
+from utils.user_index import _sorted_order
+
+# State of a user in a month without a segment, either inactive or active
+# below the lowest threshold
+NO_SEGMENT = 'none'
+
+
+def count_transitions(segments):
+    # Segment changes between consecutive entries of a month-ordered sequence
+    segments = np.asarray(segments)
+    return int((segments[1:] != segments[:-1]).sum())
+
+
+class SegmentMigration:
+    # Segment migration of every user at once. The rows of df_monthly are
+    # sorted by user and month, and each row is compared with the next one
+    # through shifted arrays instead of a loop over the users:
+    #   transitions  users per (month, from_segment, to_segment), from each
+    #                month to the next, a missing user-month counting as 'none'
+    #   users        per-user metrics indexed by the sorted user_id
+
+    @profiled('SegmentMigration')
+    def __init__(self, df_monthly, scheme=DEFAULT_SCHEME):
+        self.segments = _labels(scheme)
+        self.states = self.segments + [NO_SEGMENT]
+        n_segments, n_states = len(self.segments), len(self.states)
+
+        order = _sorted_order(df_monthly)
+        user_ids = df_monthly['user_id'].to_numpy()[order]
+        months = df_monthly['month'].to_numpy().astype('datetime64[M]')[order].astype('int64')
+        first_month = months.min()
+        months = months - first_month
+        n_months = int(months.max()) + 1
+        self.months = pd.date_range(np.datetime64(int(first_month), 'M'), periods=n_months, freq='MS')
+        # Unsegmented user-months take the code of 'none'
+        segments = pd.Categorical(df_monthly['user_segment'], categories=self.segments).codes[order].astype('int64')
+        segments[segments < 0] = n_segments
+
+        # Whether each row is followed by the same user, and by the same user
+        # in the next calendar month
+        same_user = np.append(user_ids[1:] == user_ids[:-1], False)
+        consecutive = same_user & np.append(np.diff(months) == 1, False)
+        preceded = np.insert(consecutive[:-1], 0, False)
+        changed = np.append(segments[1:] != segments[:-1], False)
+
+        # Every row but those of the last month moves to the segment of the
+        # next month, 'none' when the user is missing from it, and every row
+        # not preceded by its user comes from 'none'
+        leaving = months < n_months - 1
+        entering = ~preceded & (months > 0)
+        next_segments = np.where(consecutive, np.append(segments[1:], n_segments), n_segments)
+        from_month = np.concatenate([months[leaving], months[entering] - 1])
+        from_state = np.concatenate([segments[leaving], np.full(entering.sum(), n_segments)])
+        to_state = np.concatenate([next_segments[leaving], segments[entering]])
+        counts = np.bincount((from_month * n_states + from_state) * n_states + to_state,
+                             minlength=(n_months - 1) * n_states * n_states)
+        index = pd.MultiIndex.from_product([self.months[:-1], self.states, self.states],
+                                           names=['month', 'from_segment', 'to_segment'])
+        self.transitions = pd.Series(counts, index=index, name='users')
+
+        # Streaks are the runs of one segment over consecutive calendar months
+        run_starts = ~preceded | np.insert(changed[:-1], 0, True)
+        run_lengths = np.bincount(np.cumsum(run_starts) - 1)
+        user_starts = np.insert(~same_user[:-1], 0, True)
+        user_codes = np.cumsum(user_starts) - 1
+        n_users = int(user_codes[-1]) + 1
+        last_rows = np.flatnonzero(~same_user)
+
+        longest = np.zeros((n_users, n_states), dtype='int64')
+        np.maximum.at(longest, (user_codes[run_starts], segments[run_starts]), run_lengths)
+        months_in = np.zeros((n_users, n_states), dtype='int64')
+        np.add.at(months_in, (user_codes, segments), 1)
+        # Changes between consecutive active months of a user, across gaps
+        changes = np.bincount(user_codes[same_user & changed], minlength=n_users)
+
+        last_segments = segments[last_rows]
+        users = pd.DataFrame({
+            'months_active': np.bincount(user_codes, minlength=n_users),
+            'segment_changes': changes,
+            'distinct_segments': (months_in[:, :n_segments] > 0).sum(axis=1),
+            'last_month': self.months[months[last_rows]],
+            'last_segment': pd.Categorical.from_codes(np.where(last_segments < n_segments, last_segments, -1),
+                                                      self.segments),
+        }, index=pd.Index(user_ids[user_starts], name='user_id'))
+        for code, segment in enumerate(self.segments):
+            users[f'months_{segment}'] = months_in[:, code]
+            users[f'longest_{segment}'] = longest[:, code]
+        self.users = users
+
+    def __len__(self):
+        return len(self.users)
+
+    def matrix(self, months=None, normalize=False):
+        # from_segment x to_segment users, summed over the given months or
+        # over all of them. Normalized, each row holds the shares of the users
+        # of its from_segment.
+        transitions = self.transitions
+        if months is not None:
+            transitions = transitions[transitions.index.get_level_values('month').isin(months)]
+        matrix = transitions.groupby(level=['from_segment', 'to_segment'], sort=False).sum().unstack()
+        matrix = matrix.reindex(index=self.states, columns=self.states, fill_value=0)
+        if normalize:
+            matrix = matrix.div(matrix.sum(axis=1).replace(0, np.nan), axis=0)
+        return matrix
+
+    def flows(self, segment='A'):
+        # Users moving into, out of and staying in a segment from each month
+        # to the next
+        matrices = self.transitions.unstack('to_segment')
+        stayed = matrices[segment].xs(segment, level='from_segment')
+        return pd.DataFrame({
+            'into': matrices[segment].groupby(level='month').sum() - stayed,
+            'out_of': matrices.xs(segment, level='from_segment').sum(axis=1) - stayed,
+            'stayed': stayed,
+        })
+
+    def user(self, user_id):
+        # Metrics of one user by binary search, None for an unknown user
+        i = self.users.index.searchsorted(user_id)
+        if i == len(self.users) or self.users.index[i] != user_id:
+            return None
+        return self.users.iloc[i]
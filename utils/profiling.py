@@ -0,0 +1,203 @@
+import functools
+import itertools
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import pandas as pd
+import streamlit as st
+
+from utils.result_cache import results
+
+# Stage instrumentation, off unless DASHBOARD_PROFILE is set. Disabled, the
+# profiled decorator returns the function itself and stage() a shared no-op
+# context, so the instrumented code runs as if it were not.
+#
+#   DASHBOARD_PROFILE=1 streamlit run streamlit_app.py
+ENABLED = os.environ.get('DASHBOARD_PROFILE', '') not in ('', '0')
+
+# Records kept for the trace export, oldest dropped first
+MAX_RECORDS = 10_000
+
+STATM_PATH = Path('/proc/self/statm')
+logger = logging.getLogger('dashboard.profile')
+
+_records = deque(maxlen=MAX_RECORDS)
+_run_ids = itertools.count(1)
+_local = threading.local()
+_started = time.perf_counter()
+
+
+def rss_bytes():
+    # Resident memory of the process. Without /proc only the high water mark
+    # is available, which only grows.
+    if STATM_PATH.exists():
+        return int(STATM_PATH.read_text().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def count_rows(value):
+    # Rows of a frame, of the first frame of a tuple, None for anything else
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    return None
+
+
+class Stage:
+    # One timed stage. rows_in and rows_out can be set inside the block.
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+
+    def __enter__(self):
+        self._depth = getattr(_local, 'depth', 0)
+        _local.depth = self._depth + 1
+        self._memory = rss_bytes()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        _local.depth = self._depth
+        record = {
+            'run': getattr(_local, 'run', None),
+            'page': getattr(_local, 'page', None),
+            'stage': self.name,
+            'depth': self._depth,
+            'start': round(self._start - _started, 6),
+            'seconds': round(end - self._start, 6),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'memory_mb': round((rss_bytes() - self._memory) / 2**20, 2),
+            'thread': threading.get_ident(),
+        }
+        _records.append(record)
+        run_records = getattr(_local, 'records', None)
+        if run_records is not None:
+            run_records.append(record)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(record))
+
+
+class _NoStage:
+    rows_in = rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name, rows_in=None):
+    # Time the block under name: with stage('chart') as s: ...
+    if not ENABLED:
+        return _NO_STAGE
+    return Stage(name, rows_in)
+
+
+def profiled(name=None):
+    # Decorator timing every call of a function, with the rows of its first
+    # frame argument and of its result
+    def decorate(func):
+        if not ENABLED:
+            return func
+
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Stage(stage_name, count_rows(args[0]) if args else None) as s:
+                result = func(*args, **kwargs)
+                s.rows_out = count_rows(result)
+            return result
+        return wrapper
+    return decorate
+
+
+def start_run(page):
+    # Mark the start of a page run, the debug panel shows the stages recorded
+    # since. Streamlit runs each session's script in its own thread.
+    if not ENABLED:
+        return
+    _local.run = next(_run_ids)
+    _local.page = page
+    _local.records = []
+    _local.depth = 0
+
+
+def run_records():
+    # Stages of the current page run
+    return list(getattr(_local, 'records', None) or [])
+
+
+def export_jsonl(records=None):
+    # Structured log, one JSON record per line
+    records = _records if records is None else records
+    return '\n'.join(json.dumps(record) for record in records)
+
+
+def export_trace(records=None):
+    # Chrome trace event file, opens in chrome://tracing or Perfetto
+    records = _records if records is None else records
+    events = [{
+        'name': record['stage'],
+        'cat': record['page'] or 'process',
+        'ph': 'X',
+        'ts': record['start'] * 1e6,
+        'dur': record['seconds'] * 1e6,
+        'pid': os.getpid(),
+        'tid': record['thread'],
+        'args': {k: record[k] for k in ['run', 'rows_in', 'rows_out', 'memory_mb']},
+    } for record in records]
+    return json.dumps({'traceEvents': events})
+
+
+def memory_report(frames):
+    # Rows, deep memory and dtypes of named frames. Object columns are listed
+    # as they hold one Python object per row instead of compact codes.
+    return pd.DataFrame([{
+        'frame': name,
+        'rows': len(df),
+        'mb': round(df.memory_usage(deep=True).sum() / 2**20, 2),
+        'dtypes': ', '.join(f"{c}: {t}" for c, t in df.dtypes.astype(str).items()),
+        'object_columns': ', '.join(map(str, df.columns[df.dtypes == object])),
+    } for name, df in frames.items()])
+
+
+def render_debug_panel(frames=None):
+    # Sidebar table of the stages of the current page run, with exports, the
+    # statistics of the result cache and the memory of the page's frames
+    if not ENABLED:
+        return
+    records = run_records()
+    with st.sidebar.expander('Debug: stage timings'):
+        if not records:
+            st.write('No stage ran, every result came from the cache.')
+        else:
+            table = pd.DataFrame(records)
+            table['stage'] = ['· ' * depth + name for depth, name in zip(table['depth'], table['stage'])]
+            st.dataframe(table[['stage', 'seconds', 'rows_in', 'rows_out', 'memory_mb']], hide_index=True)
+            st.write(f"Total: {table.loc[table['depth'] == 0, 'seconds'].sum():.3f}s")
+            st.download_button('Export log', export_jsonl(records), file_name='stages.jsonl')
+            st.download_button('Export trace', export_trace(), file_name='trace.json')
+    with st.sidebar.expander('Debug: result cache'):
+        st.write(results.stats())
+    if frames:
+        with st.sidebar.expander('Debug: frame memory'):
+            st.dataframe(memory_report(frames), hide_index=True)
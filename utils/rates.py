@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Currency ids of data/Currency Rates.csv
+BTC_CURRENCY_ID = 34
+USD_CURRENCY_ID = 8516
+
+# Oldest rate still used to convert a volume, as-of lookups past it give NaN.
+# DASHBOARD_RATE_TOLERANCE_DAYS, 3 days by default.
+TOLERANCE_DAYS = float(os.environ.get('DASHBOARD_RATE_TOLERANCE_DAYS', '3'))
+DEFAULT_TOLERANCE = pd.Timedelta(days=TOLERANCE_DAYS)
+
+
+class RateTable:
+    # Sorted, date-indexed rate arrays of every currency pair, built once from
+    # the rates frame. Volumes are converted with vectorized as-of lookups:
+    # each date takes the latest rate at or before it, as long as that rate
+    # is no older than the tolerance.
+
+    def __init__(self, rates):
+        rates = rates.dropna(subset=['date', 'open']).sort_values(
+            ['from_currency_id', 'to_currency_id', 'date'], kind='stable')
+        self._pairs = {}
+        for (from_id, to_id), pair in rates.groupby(['from_currency_id', 'to_currency_id'], sort=False):
+            # Keep the last rate of a date listed twice
+            pair = pair.drop_duplicates(subset='date', keep='last')
+            self._pairs[(from_id, to_id)] = (pair['date'].to_numpy(dtype='datetime64[ns]'),
+                                             pair['open'].to_numpy(dtype='float64'))
+
+    def pairs(self):
+        return list(self._pairs)
+
+    def _pair(self, from_id, to_id):
+        # Rates of a pair, inverted from the opposite pair when only that one exists
+        if (from_id, to_id) in self._pairs:
+            return self._pairs[(from_id, to_id)]
+        if (to_id, from_id) in self._pairs:
+            dates, values = self._pairs[(to_id, from_id)]
+            return dates, 1 / values
+        raise KeyError(f"no rates from currency {from_id} to {to_id}")
+
+    def rates_at(self, dates, from_id, to_id, tolerance=DEFAULT_TOLERANCE):
+        # As-of rate of every date, NaN where no rate is recent enough
+        pair_dates, values = self._pair(from_id, to_id)
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        position = np.searchsorted(pair_dates, dates, side='right') - 1
+        found = position >= 0
+        position = np.where(found, position, 0)
+        age = dates - pair_dates[position]
+        fresh = found & (age <= np.timedelta64(pd.Timedelta(tolerance).value, 'ns'))
+        return np.where(fresh, values[position], np.nan)
+
+    def convert(self, dates, amounts, from_id, to_id, tolerance=DEFAULT_TOLERANCE):
+        # Convert a whole column of amounts dated by dates
+        converted = np.asarray(amounts, dtype='float64') * self.rates_at(dates, from_id, to_id, tolerance)
+        if isinstance(amounts, pd.Series):
+            return pd.Series(converted, index=amounts.index)
+        return converted
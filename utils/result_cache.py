@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from plotly.basedatatypes import BaseFigure
+
+# Memory cap of the process-wide result cache in MB, 0 turns it off
+MAX_MB = float(os.environ.get('DASHBOARD_RESULT_CACHE_MB', '256'))
+
+
+def _normalize(value):
+    # JSON-able form of a filter selection in which the order of the
+    # selected values does not matter
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in sorted(value.items(), key=lambda item: str(item[0]))}
+    if isinstance(value, (list, tuple, set, frozenset, np.ndarray, pd.Index, pd.Series, pd.Categorical)):
+        return sorted({str(v) for v in value})
+    if isinstance(value, (np.generic, pd.Timestamp)):
+        return str(value)
+    return value
+
+
+def canonical_key(version, **selection):
+    # Hash of a dataset version and a filter selection. Selections listing
+    # the same values in another order share a key.
+    payload = json.dumps({'version': version, 'selection': _normalize(selection)}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _sequence_bytes(values):
+    # Size of a sequence sampled from its first item, so long label arrays
+    # are not walked item by item
+    return len(values) * (8 + sys.getsizeof(values[0])) if len(values) else 0
+
+
+def _data_bytes(props):
+    # Size of the arrays in the property dict of a trace and its nested
+    # properties
+    total = 0
+    for value in props.values():
+        if isinstance(value, dict):
+            total += _data_bytes(value)
+        elif isinstance(value, np.ndarray) and value.dtype != object:
+            total += value.nbytes
+        elif isinstance(value, (np.ndarray, list, tuple)):
+            total += _sequence_bytes(value)
+    return total
+
+
+def estimate_bytes(value):
+    # Approximate memory held by a cached value. Figures count the data
+    # arrays of their traces, their layout is small.
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if isinstance(usage, pd.Series) else usage)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, BaseFigure):
+        # _props is the dict to_plotly_json returns a deep copy of, read
+        # in place so sizing a figure copies nothing
+        return sum(_data_bytes(trace._props) for trace in value.data)
+    if isinstance(value, dict):
+        return sum(estimate_bytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_bytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    # LRU cache of page results shared by every session of the process,
+    # bounded by the estimated memory of its entries rather than their
+    # number. Values are shared, callers must not modify them.
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = estimate_bytes(value)
+        if size > self.max_bytes:
+            return value
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+        return value
+
+    def get_or_compute(self, key, compute):
+        # Cached value of key, computed and stored on a miss. Two sessions
+        # missing the same key at once both compute it.
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, compute())
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'mb': round(self.bytes / 2**20, 2),
+            'max_mb': round(self.max_bytes / 2**20, 2),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            'evictions': self.evictions,
+        }
+
+
+results = ResultCache(int(MAX_MB * 2**20))
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+# Minimum monthly volume of each segment. A user-month takes the segment of
+# the highest threshold it reaches and stays unsegmented below the lowest one.
+DEFAULT_SCHEME = {'A': 2_000_000, 'B': 200_000, 'C': 20_000, 'D': 1}
+
+
+def _labels(scheme):
+    # Segment labels from the highest threshold to the lowest
+    return sorted(scheme, key=scheme.get, reverse=True)
+
+
+def segment_schemes(volumes, schemes):
+    # Segment the volumes under several threshold schemes in one pass. All the
+    # thresholds are binned together with a single searchsorted, and each
+    # scheme then maps the shared bins to its own codes with a lookup table.
+    index = volumes.index if isinstance(volumes, pd.Series) else None
+    values = np.asarray(volumes, dtype='float64')
+
+    thresholds = np.unique(np.concatenate([np.asarray(list(s.values()), dtype='float64') for s in schemes.values()]))
+    # Bin 0 is below every threshold, bin k is at or above the k-th threshold
+    bins = np.searchsorted(thresholds, values, side='right')
+    bins[np.isnan(values)] = 0
+
+    result = {}
+    for name, scheme in schemes.items():
+        labels = _labels(scheme)
+        lookup = np.full(len(thresholds) + 1, -1, dtype='int8')
+        for code, label in reversed(list(enumerate(labels))):
+            lookup[np.searchsorted(thresholds, scheme[label]) + 1:] = code
+        result[name] = pd.Categorical.from_codes(lookup[bins], categories=labels)
+    return pd.DataFrame(result, index=index)
+
+
+def segment_volumes(volumes, scheme=DEFAULT_SCHEME):
+    # Categorical segment of each volume under a single scheme
+    segments = segment_schemes(volumes, {'user_segment': scheme})['user_segment']
+    return segments if isinstance(volumes, pd.Series) else segments.array
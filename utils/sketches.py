@@ -0,0 +1,101 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.profiling import profiled
+
+# Relative accuracy of the quantile sketches: a quantile estimate is within
+# this fraction of the value of the exact rank
+ACCURACY = float(os.environ.get('DASHBOARD_SKETCH_ACCURACY', '0.01'))
+
+# Volumes below this, and missing ones, fall in the zero bucket
+MIN_VALUE = 0.01
+
+# Users kept per leaderboard slice, the pages show the first ones
+LEADERBOARD_SIZE = int(os.environ.get('DASHBOARD_LEADERBOARD_SIZE', '100'))
+
+
+def _gamma(accuracy):
+    return (1 + accuracy) / (1 - accuracy)
+
+
+def bucket_codes(values, accuracy=ACCURACY):
+    # Logarithmic bucket of each value, as in DDSketch: bucket i holds the
+    # values in (gamma^(i-1), gamma^i]. Codes are shifted so that 0 is the
+    # zero bucket and the first positive bucket holds MIN_VALUE.
+    values = np.asarray(values, dtype='float64')
+    log_gamma = np.log(_gamma(accuracy))
+    offset = int(np.ceil(np.log(MIN_VALUE) / log_gamma)) - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        codes = np.ceil(np.log(values) / log_gamma) - offset
+    return np.where(values >= MIN_VALUE, codes, 0).astype('int32')
+
+
+def bucket_values(codes, accuracy=ACCURACY):
+    # Value standing for each bucket, within the accuracy of all its values
+    gamma = _gamma(accuracy)
+    offset = int(np.ceil(np.log(MIN_VALUE) / np.log(gamma))) - 1
+    codes = np.asarray(codes)
+    return np.where(codes > 0, 2 * gamma ** (codes + offset) / (gamma + 1), 0.0)
+
+
+def sketch_counts(groups, codes, n_groups):
+    # One sketch per group: the counts of its values in each bucket. The
+    # sketches of two slices of the data merge by adding their counts.
+    n_buckets = int(codes.max()) + 1 if len(codes) else 1
+    counts = np.bincount(np.asarray(groups, dtype='int64') * n_buckets + codes, minlength=n_groups * n_buckets)
+    return counts.reshape(n_groups, n_buckets)
+
+
+def sketch_quantiles(counts, quantiles, accuracy=ACCURACY):
+    # Quantiles of each sketch, NaN for empty ones. The value of rank
+    # q * (count - 1) is looked up in the cumulative bucket counts.
+    cumulative = np.cumsum(counts, axis=1)
+    totals = cumulative[:, -1]
+    result = np.full((len(counts), len(quantiles)), np.nan)
+    for j, q in enumerate(quantiles):
+        ranks = q * (totals - 1)
+        codes = (cumulative <= ranks[:, None]).sum(axis=1)
+        result[:, j] = np.where(totals > 0, bucket_values(np.minimum(codes, counts.shape[1] - 1), accuracy), np.nan)
+    return result
+
+
+class Leaderboards:
+    # Top traders by volume in each (month, account_type) slice, at most
+    # `size` of them per slice. The lists of several slices merge into a
+    # leaderboard of their union with a bounded error: a user left out of a
+    # slice's list traded at most the largest volume left out there, so its
+    # summed volume is low by at most the sum of those thresholds.
+
+    @profiled('Leaderboards')
+    def __init__(self, user_month_attrs, size=LEADERBOARD_SIZE):
+        volumes = user_month_attrs.groupby(['month', 'account_type', 'user_id'], observed=True, sort=False, dropna=False)['volume'].sum()
+        volumes = volumes.reset_index()
+        # Largest volumes first within each slice, keep the first entries
+        volumes = volumes.sort_values(['month', 'account_type', 'volume'], ascending=[True, True, False], ignore_index=True)
+        rank = volumes.groupby(['month', 'account_type'], observed=True, sort=False, dropna=False).cumcount()
+        self.slices = pd.DataFrame({
+            'users': volumes.groupby(['month', 'account_type'], observed=True, dropna=False).size(),
+            # Slices with every user listed have no threshold
+            'threshold': volumes[rank == size].set_index(['month', 'account_type'])['volume'],
+        }).fillna({'threshold': 0.0}).reset_index()
+        self.entries = volumes[rank < size].reset_index(drop=True)
+        self.size = size
+
+    def top(self, account_types, months=None, n=10):
+        # Leaderboard of the union of the chosen slices: each user's summed
+        # volume over the slices listing it, and the most it can be short of
+        # the exact total
+        slices = self.slices[self.slices['account_type'].isin(account_types)]
+        entries = self.entries[self.entries['account_type'].isin(account_types)]
+        if months is not None:
+            slices = slices[slices['month'].isin(months)]
+            entries = entries[entries['month'].isin(months)]
+        board = entries.groupby('user_id', sort=False)[['volume']].sum()
+
+        # Sum of the thresholds of the slices missing each user
+        keys = slices.set_index(['month', 'account_type'])['threshold']
+        listed = entries.join(keys, on=['month', 'account_type']).groupby('user_id', sort=False)['threshold'].sum()
+        board['max_error'] = keys.sum() - listed.reindex(board.index).to_numpy()
+        return board.nlargest(n, 'volume').reset_index()
@@ -0,0 +1,355 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+from utils.exchanges import map_account_ids, exchange_match_report
+from utils.funcs import ACCOUNT_TYPE_REPLACEMENTS, ATTRIBUTE_COLUMNS, contains, replace_values
+from utils.profiling import profiled
+from utils.rates import BTC_CURRENCY_ID, USD_CURRENCY_ID, DEFAULT_TOLERANCE
+from utils.segments import DEFAULT_SCHEME, _labels
+from utils.sketches import ACCURACY, MIN_VALUE, _gamma, sketch_quantiles
+
+try:
+    import duckdb
+except ImportError:  # The pages keep to the pandas path
+    duckdb = None
+
+
+def _scan(path):
+    # Table expression reading the parquet copy of an input file
+    path = str(path).replace("'", "''")
+    return f"read_parquet('{path}', file_row_number = true)"
+
+
+def _segment_case(column, scheme=DEFAULT_SCHEME):
+    # SQL counterpart of segment_volumes
+    whens = ' '.join(f"WHEN {column} >= {scheme[label]} THEN '{label}'" for label in _labels(scheme))
+    return f"CASE {whens} END"
+
+
+def _bucket_case(column, accuracy=ACCURACY):
+    # SQL counterpart of bucket_codes
+    log_gamma = float(np.log(_gamma(accuracy)))
+    offset = int(np.ceil(np.log(MIN_VALUE) / log_gamma)) - 1
+    return f"CASE WHEN {column} >= {MIN_VALUE} THEN CAST(ceil(ln({column}) / {log_gamma!r}) AS INTEGER) + {-offset} ELSE 0 END"
+
+
+def _in(column, count):
+    return f"{column} IN ({', '.join('?' * count)})" if count else 'FALSE'
+
+
+def _in_or_null(column, count, null):
+    # _in that also selects NULL, the missing value of a filter
+    return f"({_in(column, count)} OR {column} IS NULL)" if null else _in(column, count)
+
+
+class SqlBackend:
+    # In-process DuckDB backend of the page queries. It scans the input files
+    # directly, with the sidebar filters and the needed columns pushed down
+    # to the scan, and runs the joins and aggregations on all cores. The
+    # pandas path stays the reference: the small name lookups are resolved
+    # by the same functions, and check_backends compares the two.
+
+    def __init__(self, commas_path, global_path, rates_path, exchange_map):
+        self.exchange_map = exchange_map
+        self._con = duckdb.connect()
+        self._commas = _scan(commas_path)
+        self._global = _scan(global_path)
+        self._rates = _scan(rates_path)
+
+        # Cleaned name and account_id of every raw account_type, resolved
+        # with clean_volumes' rules so both backends agree on them
+        raw = pd.Series(self._distinct(self._commas, 'account_type'), dtype='category')
+        self.account_types = pd.DataFrame({
+            'raw': raw.astype(str),
+            'account_type': replace_values(raw, ACCOUNT_TYPE_REPLACEMENTS).astype(str),
+            'paper': contains(raw, 'paper').to_numpy(),
+        })
+        self.account_types['account_id'] = map_account_ids(self.account_types['account_type'], exchange_map['3commas']).to_numpy()
+        names = pd.Series(self._distinct(self._global, 'exchange_name'), dtype='category')
+        self.exchange_names = pd.DataFrame({'raw': names.astype(str),
+                                            'account_id': map_account_ids(names, exchange_map['Global']).to_numpy()})
+        # Stored as tables, as registered frames are not visible to cursors
+        self._con.from_df(self.account_types).create('account_types')
+        self._con.from_df(self.exchange_names).create('exchange_names')
+        self._options = {}
+
+    def _distinct(self, scan, column):
+        return self._con.execute(f"SELECT DISTINCT {column} FROM {scan} WHERE {column} IS NOT NULL").df()[column]
+
+    def _query(self, sql, params=()):
+        # Each call gets its own cursor, sessions query concurrently
+        return self._con.cursor().execute(sql, list(params)).df()
+
+    def _nullable(self, scan, columns):
+        # Columns of a scan holding missing values
+        row = self._con.execute(f"SELECT {', '.join(f'bool_or({c} IS NULL) AS {c}' for c in columns)} FROM {scan}").df()
+        return [c for c in columns if row.at[0, c]]
+
+    def _raw_account_types(self, account_types):
+        # Raw spellings of cleaned account types, for filtering the scan
+        rows = self.account_types[~self.account_types['paper'] & self.account_types['account_type'].isin(account_types)]
+        return rows['raw'].tolist()
+
+    def exchange_report(self):
+        # exchange_match_report of the names found in the input files
+        account_types = self.account_types.loc[~self.account_types['paper'], 'account_type']
+        return exchange_match_report(account_types, self.exchange_names['raw'], self.exchange_map)
+
+    def _cached_options(self, key, compute):
+        # Filter options only depend on the input files, and the backend is
+        # built once per version of them, so they are computed once per
+        # backend instead of on every page run. Callers must not modify them.
+        if key not in self._options:
+            self._options[key] = compute()
+        return self._options[key]
+
+    def attribute_values(self):
+        return self._cached_options('attribute_values', self._attribute_values)
+
+    def _attribute_values(self):
+        # Distinct values of each segment page filter, with np.nan for a
+        # missing value as in the cube cells
+        values = {'account_type': sorted(self.account_types.loc[~self.account_types['paper'], 'account_type'].unique())}
+        for column in ATTRIBUTE_COLUMNS[1:]:
+            values[column] = sorted(self._distinct(self._commas, column).astype(str))
+        for column in self._nullable(self._commas, ATTRIBUTE_COLUMNS):
+            values[column].append(np.nan)
+        return values
+
+    def _filter_sql(self, column, values):
+        # Condition and parameters of a filter on a column of the scan
+        null = any(pd.isna(v) for v in values)
+        values = [str(v) for v in values if not pd.isna(v)]
+        if column == 'account_type':
+            values = self._raw_account_types(values)
+        return _in_or_null(f"c.{column}", len(values), null), values
+
+    def _segment_sql(self, segments, filters, select):
+        # Query over the user-months of the chosen segments with a row
+        # matching every filter, u.total being their monthly volume. The
+        # user-month totals need every row, the filters only narrow the scan
+        # of the matching rows.
+        conditions, params = [], []
+        for column, values in filters.items():
+            condition, values = self._filter_sql(column, values)
+            conditions.append(condition)
+            params.extend(values)
+        segments = [str(s) for s in segments]
+        sql = f"""
+            WITH user_months AS (
+                SELECT c.user_id, date_trunc('month', c.month) AS month, sum(c.usd_amount) AS total
+                FROM {self._commas} c LEFT JOIN account_types t ON c.account_type = t.raw
+                WHERE NOT coalesce(t.paper, FALSE) AND c.user_id IS NOT NULL AND c.month IS NOT NULL
+                GROUP BY ALL
+            ), matching AS (
+                SELECT c.user_id, date_trunc('month', c.month) AS month, sum(c.usd_amount) AS volume, count(*) AS rows
+                FROM {self._commas} c LEFT JOIN account_types t ON c.account_type = t.raw
+                WHERE NOT coalesce(t.paper, FALSE) AND c.user_id IS NOT NULL AND c.month IS NOT NULL
+                    AND {' AND '.join(conditions) or 'TRUE'}
+                GROUP BY ALL
+            )
+            SELECT u.month, {_segment_case('u.total')} AS user_segment, {select}
+            FROM user_months u JOIN matching m USING (user_id, month)
+            WHERE {_in(_segment_case('u.total'), len(segments))}
+            GROUP BY ALL
+            ORDER BY ALL
+        """
+        result = self._query(sql, params + segments)
+        result['month'] = result['month'].astype('datetime64[ns]')
+        result['user_segment'] = pd.Categorical(result['user_segment'], categories=_labels(DEFAULT_SCHEME))
+        return result
+
+    @profiled('SqlBackend.segment_summary')
+    def segment_summary(self, segments, filters):
+        # Same result as FilterCube.query
+        result = self._segment_sql(segments, filters, 'count(*) AS users, sum(u.total) AS usd_amount, '
+                                                      'sum(m.volume) AS volume, sum(m.rows) AS rows')
+        result['rows'] = result['rows'].astype('int64')
+        return result.set_index(['month', 'user_segment'])
+
+    @profiled('SqlBackend.segment_quantiles')
+    def segment_quantiles(self, segments, filters, quantiles=(0.5, 0.9, 0.99)):
+        # Same result as FilterCube.quantiles, from the bucket counts of the
+        # same sketches
+        counts = self._segment_sql(segments, filters, f"{_bucket_case('u.total')} AS bucket, count(*) AS users")
+        counts = counts.pivot_table(index=['month', 'user_segment'], columns='bucket', values='users',
+                                    aggfunc='sum', fill_value=0, observed=True)
+        counts = counts.reindex(columns=range(counts.columns.max() + 1 if len(counts.columns) else 1), fill_value=0)
+        return pd.DataFrame(sketch_quantiles(counts.to_numpy(), quantiles, ACCURACY), index=counts.index,
+                            columns=[f'p{q * 100:g}' for q in quantiles])
+
+    @profiled('SqlBackend.top_traders')
+    def top_traders(self, account_types, months=None, n=10):
+        # Exact counterpart of Leaderboards.top, so max_error is always 0
+        condition, raw_types = self._filter_sql('account_type', account_types)
+        conditions, params = [condition], list(raw_types)
+        if months is not None:
+            conditions.append(_in("date_trunc('month', c.month)", len(months)))
+            params.extend(pd.Timestamp(m).to_pydatetime() for m in months)
+        sql = f"""
+            SELECT c.user_id, sum(c.usd_amount) AS volume, 0.0 AS max_error
+            FROM {self._commas} c
+            WHERE c.user_id IS NOT NULL AND c.month IS NOT NULL AND {' AND '.join(conditions)}
+            GROUP BY ALL
+            ORDER BY volume DESC, user_id
+            LIMIT {int(n)}
+        """
+        return self._query(sql, params)
+
+    def _benchmark_sql(self, where, tolerance):
+        # The build_benchmark chain: global volumes keyed by account_id,
+        # converted with the as-of BTC rate no older than the tolerance and
+        # summed per month and account_id, joined to the 3Commas volumes of
+        # the same month and account_id summed per account type. Rates listed twice for a date keep the last row,
+        # and only the inverse pair is used when the direct one is missing.
+        tolerance_us = int(pd.Timedelta(tolerance).total_seconds() * 1_000_000)
+        return f"""
+            WITH pairs AS (
+                SELECT from_currency_id, to_currency_id, date, open, file_row_number
+                FROM {self._rates} WHERE date IS NOT NULL AND open IS NOT NULL
+            ), direct AS (
+                SELECT date, open, file_row_number FROM pairs
+                WHERE from_currency_id = {BTC_CURRENCY_ID} AND to_currency_id = {USD_CURRENCY_ID}
+            ), rates AS (
+                SELECT date, open FROM (
+                    SELECT * FROM direct
+                    UNION ALL
+                    SELECT date, 1 / open, file_row_number FROM pairs
+                    WHERE from_currency_id = {USD_CURRENCY_ID} AND to_currency_id = {BTC_CURRENCY_ID}
+                        AND NOT EXISTS (SELECT 1 FROM direct)
+                )
+                QUALIFY row_number() OVER (PARTITION BY date ORDER BY file_row_number DESC) = 1
+            ), commas AS (
+                SELECT date_trunc('month', c.month) AS month, t.account_id, t.account_type,
+                    sum(c.usd_amount) AS usd_amount_3commas
+                FROM {self._commas} c JOIN account_types t ON c.account_type = t.raw
+                WHERE NOT t.paper AND t.account_id >= 0 AND c.month IS NOT NULL AND c.exchange_type IS NOT NULL
+                    AND {where['commas']}
+                GROUP BY ALL
+            ), global_rows AS (
+                SELECT g.report_date, g.btc_volume, n.account_id,
+                    replace(g.exchange_type, 'futures', 'future') AS exchange_type
+                FROM {self._global} g JOIN exchange_names n ON g.exchange_name = n.raw
+                WHERE n.account_id IN (SELECT account_id FROM commas)
+                    AND g.report_date IS NOT NULL AND g.exchange_type IS NOT NULL AND {where['global']}
+            ), converted AS (
+                SELECT g.*, CASE WHEN epoch_us(g.report_date) - epoch_us(r.date) <= {tolerance_us}
+                    THEN g.btc_volume * r.open END AS usd_amount
+                FROM global_rows g ASOF LEFT JOIN rates r ON g.report_date >= r.date
+            ), global_months AS (
+                SELECT date_trunc('month', report_date) AS month, account_id,
+                    sum(usd_amount) AS usd_amount_global,
+                    count(*) FILTER (WHERE usd_amount IS NULL AND btc_volume IS NOT NULL) AS unconverted_rows
+                FROM converted GROUP BY ALL
+            )
+            SELECT g.month, g.account_id, g.usd_amount_global, g.unconverted_rows,
+                c.account_type, c.usd_amount_3commas
+            FROM global_months g JOIN commas c USING (month, account_id)
+        """
+
+    def benchmark_options(self, tolerance=DEFAULT_TOLERANCE):
+        return self._cached_options(('benchmark_options', tolerance), lambda: self._benchmark_options(tolerance))
+
+    def _benchmark_options(self, tolerance):
+        # Months and account types present in the benchmark
+        sql = f"SELECT DISTINCT month, account_type FROM ({self._benchmark_sql({'commas': 'TRUE', 'global': 'TRUE'}, tolerance)}) ORDER BY ALL"
+        options = self._query(sql)
+        options['month'] = options['month'].astype('datetime64[ns]')
+        return options
+
+    @profiled('SqlBackend.summarize_benchmark')
+    def summarize_benchmark(self, months, account_types, tolerance=DEFAULT_TOLERANCE):
+        # Same result as summarize_benchmark. The months bound both scans, and
+        # the account types select the raw 3Commas spellings to read.
+        months = sorted(pd.Timestamp(m) for m in months)
+        raw_types = self._raw_account_types([str(a) for a in account_types])
+        if months:
+            start, stop = months[0], months[-1] + pd.offsets.MonthBegin()
+            month_list = ', '.join(f"TIMESTAMP '{m}'" for m in months)
+            commas = f"c.month >= TIMESTAMP '{start}' AND c.month < TIMESTAMP '{stop}' AND date_trunc('month', c.month) IN ({month_list}) AND {_in('c.account_type', len(raw_types))}"
+            global_ = f"g.report_date >= TIMESTAMP '{start}' AND g.report_date < TIMESTAMP '{stop}'"
+        else:
+            commas = global_ = 'FALSE'
+        sql = f"""
+            WITH benchmark AS ({self._benchmark_sql({'commas': commas, 'global': global_}, tolerance)}),
+            -- Global totals are repeated for every account type of an account_id, count each one once
+            global_totals AS (
+                SELECT month, sum(usd_amount_global) AS usd_amount_global, sum(unconverted_rows) AS unconverted_rows
+                FROM (SELECT DISTINCT month, account_id, usd_amount_global, unconverted_rows FROM benchmark)
+                GROUP BY month
+            )
+            SELECT month, g.usd_amount_global, sum(b.usd_amount_3commas) AS usd_amount_3commas, g.unconverted_rows
+            FROM benchmark b JOIN global_totals g USING (month) GROUP BY ALL ORDER BY month
+        """
+        result = self._query(sql, raw_types if months else [])
+        result['month'] = result['month'].astype('datetime64[ns]')
+        unconverted = result.set_index('month')['unconverted_rows'].astype('int64')
+        return result.drop(columns='unconverted_rows'), unconverted[unconverted > 0]
+
+
+def check_backends(backend, cube, benchmark, samples=20, seed=0, rtol=1e-6):
+    # Compare the SQL backend with the pandas reference on the full selection
+    # and on random subsets of the filters. Returns the mismatching queries.
+    from utils.benchmark import summarize_benchmark
+
+    rng = np.random.default_rng(seed)
+    options = backend.attribute_values()
+    months = benchmark['month'].unique()
+    account_types = benchmark['account_type'].unique()
+    segments = _labels(DEFAULT_SCHEME)
+
+    def subset(values, full):
+        # Picked by position, np.nan among strings would become 'nan'
+        if full:
+            return list(values)
+        return [values[i] for i in rng.choice(len(values), rng.integers(1, len(values) + 1), replace=False)]
+
+    failures = []
+    for i in range(samples + 1):
+        full = i == 0
+        chosen_segments = subset(segments, full)
+        filters = {column: subset(values, full) for column, values in options.items()}
+        expected = cube.query(chosen_segments, filters)
+        actual = backend.segment_summary(chosen_segments, filters).reindex(expected.index)
+        if len(actual.dropna()) != len(expected) or not np.allclose(actual.to_numpy(dtype='float64'), expected.to_numpy(dtype='float64'), rtol=rtol):
+            failures.append(('segment_summary', chosen_segments, filters))
+        # Sketches of the two backends may bucket a boundary value apart
+        expected = cube.quantiles(chosen_segments, filters)
+        actual = backend.segment_quantiles(chosen_segments, filters).reindex(expected.index)
+        if not np.allclose(actual.to_numpy(dtype='float64'), expected.to_numpy(dtype='float64'), rtol=2.5 * ACCURACY):
+            failures.append(('segment_quantiles', chosen_segments, filters))
+
+        chosen_months, chosen_types = subset(months, full), subset(account_types, full)
+        expected, expected_unconverted = summarize_benchmark(benchmark, chosen_months, chosen_types)
+        actual, actual_unconverted = backend.summarize_benchmark(chosen_months, chosen_types)
+        same = (len(actual) == len(expected)
+                and (actual['month'].to_numpy() == expected['month'].to_numpy()).all()
+                and np.allclose(actual.iloc[:, 1:].to_numpy(dtype='float64'), expected.iloc[:, 1:].to_numpy(dtype='float64'), rtol=rtol, equal_nan=True)
+                and actual_unconverted.to_dict() == expected_unconverted.to_dict())
+        if not same:
+            failures.append(('summarize_benchmark', chosen_months, chosen_types))
+    return failures
+
+
+if __name__ == '__main__':
+    # python -m utils.sql_backend: check the backend against pandas on data/
+    from utils.data import (COMMAS_PATH, GLOBAL_PATH, RATES_PATH, ACCOUNT_IDS_PATH, columnar_copy, read_dataset)
+    from utils.benchmark import build_benchmark
+    from utils.cube import FilterCube
+    from utils.exchanges import build_exchange_map
+    from utils.funcs import preprocess_data, aggregate_tables
+    from utils.rates import RateTable
+
+    exchange_map = build_exchange_map(pd.read_csv(ACCOUNT_IDS_PATH))
+    tables = aggregate_tables(preprocess_data(read_dataset(COMMAS_PATH))[0])
+    cube = FilterCube(tables['user_month_attributes'], tables['user_months'])
+    benchmark = build_benchmark(tables['account_months'], read_dataset(GLOBAL_PATH),
+                                RateTable(read_dataset(RATES_PATH)), exchange_map)
+    backend = SqlBackend(columnar_copy(COMMAS_PATH), columnar_copy(GLOBAL_PATH), columnar_copy(RATES_PATH), exchange_map)
+    failures = check_backends(backend, cube, benchmark)
+    for failure in failures:
+        print('mismatch:', *failure)
+    print('backends agree' if not failures else f'{len(failures)} mismatches')
+    sys.exit(1 if failures else 0)
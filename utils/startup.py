@@ -0,0 +1,54 @@
+import logging
+import os
+import threading
+from pathlib import Path
+
+import streamlit as st
+
+# Cold start helpers. This module only imports streamlit, so the home page
+# paints without waiting for pandas or the data. Streamlit itself imports
+# plotly.
+
+# Load the data caches in the background once the first page of the process
+# has rendered, unless DASHBOARD_WARMUP=0
+WARMUP = os.environ.get('DASHBOARD_WARMUP', '1') not in ('', '0')
+
+LOGO_PATH = Path(__file__).parent.parent / 'img/logo.png'
+logger = logging.getLogger('dashboard.startup')
+
+
+@st.cache_resource(show_spinner=False)
+def _logo_bytes(path):
+    # Read once per process, Streamlit decodes the image in the browser
+    return Path(path).read_bytes()
+
+
+def load_logo():
+    st.logo(_logo_bytes(str(LOGO_PATH)), size="large", link=None, icon_image=None)
+
+
+@st.cache_resource(show_spinner=False)
+def _warm():
+    # Build every cached table the pages read. A page asking for one of
+    # them meanwhile waits for this computation instead of repeating it.
+    # Called from a cached function, the loaders show no spinner, which
+    # would need a page to show it in.
+    from utils import data
+
+    loaders = [data.load_aggregates, data.load_filter_cube, data.load_user_index, data.load_leaderboards,
+               data.load_segment_migration, data.load_benchmark, data.load_exchange_report, data.load_sql_backend]
+    for loader in loaders:
+        try:
+            loader()
+        except Exception:
+            logger.exception('warm-up of %s failed', loader.__name__)
+
+
+@st.cache_resource(show_spinner=False)
+def start_warmup():
+    # Start the warm-up thread, once per process
+    if not WARMUP:
+        return None
+    thread = threading.Thread(target=_warm, name='dashboard-warmup', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,148 @@
+import json
+import os
+import pickle
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+import pandas as pd
+
+from utils.data import (STORE_DIR, COMMAS_PATH, ACCOUNT_IDS_PATH, MANIFEST_NAME, STORE_FORMAT, SCHEMAS,
+                        AGGREGATE_TABLES, DERIVED_DIR, read_csv_typed, read_manifest, load_store_table,
+                        derived_path, derived_settings)
+from utils.benchmark import join_benchmark
+from utils.cube import FilterCube
+from utils.exchanges import build_exchange_map
+from utils.funcs import clean_volumes, aggregate_tables
+from utils.migration import SegmentMigration
+from utils.sketches import Leaderboards
+from utils.streaming import preprocess_chunks, DEFAULT_CHUNKSIZE
+from utils.user_index import UserIndex
+
+
+def _partition_path(store_dir, table, month):
+    return Path(store_dir) / table / f"{month:%Y-%m}.parquet"
+
+
+def write_partition(frame, path):
+    # Write next to the target and rename, so readers never see a partial file.
+    # The dot prefix hides the temporary file from dataset reads.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name('.' + path.name + '.tmp')
+    frame.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def drop_partitions(store_dir, table, keep):
+    # Remove the stored months of a table that are not in keep
+    keep = {f"{pd.Timestamp(month):%Y-%m}" for month in keep}
+    for path in (Path(store_dir) / table).glob('*.parquet'):
+        if path.stem not in keep:
+            path.unlink(missing_ok=True)
+
+
+def write_months(frame, table, months, store_dir=STORE_DIR):
+    # Replace the stored partitions of the given months of a table with the
+    # rows of frame, a month without rows gets an empty partition
+    by_month = dict(tuple(frame.groupby('month', sort=False)))
+    for month in months:
+        write_partition(by_month.get(month, frame.iloc[:0]), _partition_path(store_dir, table, month))
+
+
+def ingest_tables(tables, store_dir=STORE_DIR):
+    # Fold the aggregate tables of a slice of raw 3Commas volumes into the
+    # store. Only the months in the slice are written, and each one replaces
+    # its stored partitions, so loading a month again or loading a corrected
+    # export of it is idempotent. A slice must therefore hold every row of
+    # its months.
+    months = [pd.Timestamp(month) for month in sorted(tables['user_months']['month'].unique())]
+    for table, frame in tables.items():
+        write_months(frame, table, months, store_dir)
+    return months
+
+
+def ingest(df, store_dir=STORE_DIR):
+    # Ingest raw 3Commas volume rows held in memory
+    return ingest_tables(aggregate_tables(clean_volumes(df)), store_dir)
+
+
+def ingest_csv(path, store_dir=STORE_DIR, chunksize=DEFAULT_CHUNKSIZE):
+    # Ingest a 3Commas volumes CSV export with the same columns as the main
+    # file, streamed in chunks so its size is not bounded by memory
+    with read_csv_typed(path, SCHEMAS[COMMAS_PATH.name], chunksize=chunksize) as chunks:
+        return ingest_tables(preprocess_chunks(chunks, chunksize), store_dir)
+
+
+def write_benchmark(months=None, store_dir=STORE_DIR):
+    # Join the stored 3Commas and global monthly totals into the benchmark
+    # partitions of the given months, every stored month by default. Only
+    # the partitions of those months are read.
+    account_months = load_store_table('account_months', store_dir, months=months)
+    global_months = load_store_table('global_months', store_dir, months=months)
+    if account_months is None or global_months is None:
+        return None
+    benchmark = join_benchmark(account_months, global_months, build_exchange_map(pd.read_csv(ACCOUNT_IDS_PATH)))
+    if months is None:
+        months = [pd.Timestamp(month) for month in sorted(benchmark['month'].unique())]
+        drop_partitions(store_dir, 'benchmark', keep=months)
+    write_months(benchmark, 'benchmark', months, store_dir)
+    return benchmark
+
+
+def write_derived(store_dir=STORE_DIR):
+    # Build the structures the pages derive from the aggregate tables out of
+    # the stored tables, and pickle them in the store. They cover every
+    # stored month, so they are rebuilt whole after any write to the tables.
+    tables = {table: load_store_table(table, store_dir) for table in AGGREGATE_TABLES}
+    if any(frame is None for frame in tables.values()):
+        # Structures of an earlier build would not match the tables
+        for path in (Path(store_dir) / DERIVED_DIR).glob('*.pickle'):
+            path.unlink(missing_ok=True)
+        return []
+    attrs, user_months = tables['user_month_attributes'], tables['user_months']
+    derived = {
+        'filter_cube': FilterCube(attrs, user_months),
+        'user_index': UserIndex(attrs, user_months),
+        'leaderboards': Leaderboards(attrs),
+        'segment_migration': SegmentMigration(user_months),
+    }
+    for name, value in derived.items():
+        path = derived_path(name, store_dir)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name('.' + path.name + '.tmp')
+        with tmp_path.open('wb') as f:
+            pickle.dump((derived_settings(), value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    return list(derived)
+
+
+def write_manifest(signatures, rate_tolerance_days, store_dir=STORE_DIR):
+    # Publish the store as a complete build of the inputs with these
+    # signatures, its global volumes converted with this rate tolerance.
+    # Every write gets a new built_at, the version the pages cache the
+    # store tables under.
+    manifest = {'built_at': datetime.now(timezone.utc).isoformat(), 'format': STORE_FORMAT, 'signatures': signatures,
+                'rate_tolerance_days': rate_tolerance_days}
+    manifest_path = Path(store_dir) / MANIFEST_NAME
+    tmp_path = manifest_path.with_name('.' + MANIFEST_NAME + '.tmp')
+    tmp_path.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp_path, manifest_path)
+
+
+if __name__ == '__main__':
+    # python -m utils.store <volumes.csv> [...]: ingest the exports, rebuild
+    # the benchmark of their months and the derived structures, and publish
+    # a new version of the store
+    months = []
+    for csv_path in sys.argv[1:] or [COMMAS_PATH]:
+        for month in ingest_csv(csv_path):
+            print(f"{csv_path}: stored {month:%Y-%m}")
+            months.append(month)
+    write_benchmark(sorted(set(months)))
+    write_derived()
+    manifest = read_manifest()
+    if manifest is None:
+        print("no manifest, run python main.py --from-store to publish the store")
+    else:
+        # The store no longer matches the 3Commas input file
+        manifest['signatures'].pop(COMMAS_PATH.name, None)
+        write_manifest(manifest['signatures'], manifest.get('rate_tolerance_days'))
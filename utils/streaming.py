@@ -0,0 +1,116 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.funcs import (ATTRIBUTE_COLUMNS, clean_volumes, month_start, aggregate_account_months,
+                         build_user_month_attributes)
+from utils.segments import segment_volumes
+from utils.profiling import profiled
+
+# Raw rows read per chunk, and the partial aggregate rows kept before folding
+DEFAULT_CHUNKSIZE = 1_000_000
+
+# Keys and additive measures of each aggregate table
+TABLE_KEYS = {
+    'user_months': (['user_id', 'month'], ['usd_amount']),
+    'user_month_attributes': (['user_id', 'month'] + ATTRIBUTE_COLUMNS, ['volume', 'rows']),
+    'account_months': (['month', 'account_type', 'exchange_type'], ['usd_amount']),
+}
+
+
+def concat_frames(frames):
+    # Concatenate frames whose categorical columns have different categories.
+    # The categories are unified first, as pd.concat would otherwise fall back
+    # to object columns.
+    frames = [f for f in frames if len(f)] or frames[:1]
+    for column in frames[0].columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            categories = frames[0][column].cat.categories
+            for frame in frames[1:]:
+                categories = categories.union(frame[column].cat.categories, sort=False)
+            frames = [f.assign(**{column: f[column].cat.set_categories(categories)}) for f in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def _fold(frames, table, sort=False):
+    # Merge partial aggregates of one table by summing their measures
+    keys, measures = TABLE_KEYS[table]
+    return concat_frames(frames).groupby(keys, as_index=False, observed=True, sort=sort, dropna=False).agg(
+        {m: 'sum' for m in measures})
+
+
+def _partial_tables(chunk):
+    chunk = clean_volumes(chunk)
+    chunk = chunk.assign(month=month_start(chunk['month']))
+    return {
+        'user_months': chunk.groupby(['user_id', 'month'], as_index=False, sort=False).agg({'usd_amount': 'sum'}),
+        'user_month_attributes': build_user_month_attributes(chunk),
+        'account_months': aggregate_account_months(chunk),
+    }
+
+
+@profiled()
+def preprocess_chunks(chunks, fold_rows=DEFAULT_CHUNKSIZE):
+    # Streaming counterpart of aggregate_tables(clean_volumes(df)): every raw
+    # chunk is cleaned and reduced to partial aggregates, which are folded
+    # together once the partials added since the last fold exceed both
+    # fold_rows and the folded aggregate. A fold then reads at most twice
+    # the rows added since the previous one, so folding stays linear in the
+    # input, and peak memory is one chunk plus about twice the aggregates,
+    # whatever the size of the input. Only the summation order differs from
+    # the in-memory path.
+    partials = {table: [] for table in TABLE_KEYS}
+    folded = dict.fromkeys(TABLE_KEYS, 0)
+    for chunk in chunks:
+        for table, partial in _partial_tables(chunk).items():
+            partials[table].append(partial)
+            if sum(len(p) for p in partials[table]) - folded[table] > max(fold_rows, folded[table]):
+                partials[table] = [_fold(partials[table], table)]
+                folded[table] = len(partials[table][0])
+
+    tables = {table: _fold(frames, table, sort=table != 'user_month_attributes')
+              for table, frames in partials.items() if frames}
+    if 'user_months' in tables:
+        tables['user_months']['user_segment'] = segment_volumes(tables['user_months']['usd_amount'])
+    return tables
+
+
+def compare_tables(streamed, expected, rtol=1e-9):
+    # Names of the tables whose streamed aggregates differ from the in-memory
+    # ones: a key on one side only, a measure off by more than rtol, or
+    # another segment. Categories may be listed in another order.
+    failures = []
+    for table, (keys, measures) in TABLE_KEYS.items():
+        merged = streamed[table].merge(expected[table], on=keys, how='outer', suffixes=('', '_expected'), indicator=True)
+        same = (merged['_merge'] == 'both').all() and len(merged) == len(streamed[table]) == len(expected[table])
+        for measure in measures:
+            same = same and np.allclose(merged[measure], merged[measure + '_expected'], rtol=rtol, equal_nan=True)
+        if table == 'user_months':
+            same = same and merged['user_segment'].astype(object).equals(merged['user_segment_expected'].astype(object))
+        if not same:
+            failures.append(table)
+    return failures
+
+
+if __name__ == '__main__':
+    # python -m utils.streaming [volumes.csv] [chunksize ...]: check that the
+    # streamed tables equal the in-memory ones at each chunk size
+    from utils.data import COMMAS_PATH, iter_dataset_chunks, read_dataset
+    from utils.funcs import aggregate_tables
+
+    path = sys.argv[1] if len(sys.argv) > 1 else COMMAS_PATH
+    start = time.perf_counter()
+    expected = aggregate_tables(clean_volumes(read_dataset(path)))
+    print(f"in memory: {time.perf_counter() - start:.1f}s")
+    mismatches = 0
+    for chunksize in [int(float(n)) for n in sys.argv[2:]] or [DEFAULT_CHUNKSIZE]:
+        start = time.perf_counter()
+        streamed = preprocess_chunks(iter_dataset_chunks(path, chunksize), chunksize)
+        print(f"chunksize {chunksize}: {time.perf_counter() - start:.1f}s,", end=' ')
+        failures = compare_tables(streamed, expected)
+        print(
+              'tables agree' if not failures else 'mismatch: ' + ', '.join(failures))
+        mismatches += len(failures)
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,81 @@
+import numpy as np
+
+from utils.profiling import profiled
+
+
+def _sorted_order(frame):
+    # Row positions of the frame sorted by user_id, then month
+    return np.lexsort((frame['month'].to_numpy(), frame['user_id'].to_numpy()))
+
+
+class UserIndex:
+    # Maps each user_id to its contiguous row range in the user- and
+    # month-sorted order of the user-month attributes and of df_monthly. Only
+    # the sort permutations are stored, the frames themselves are not copied.
+
+    @profiled('UserIndex')
+    def __init__(self, user_month_attrs, df_monthly):
+        self.attrs = user_month_attrs
+        self.monthly = df_monthly
+        self._attrs_order = _sorted_order(user_month_attrs)
+        self._monthly_order = _sorted_order(df_monthly)
+        self._attrs_ids = user_month_attrs['user_id'].to_numpy()[self._attrs_order]
+        self._monthly_ids = df_monthly['user_id'].to_numpy()[self._monthly_order]
+        self.user_ids = np.unique(self._attrs_ids)
+
+    def __getstate__(self):
+        # Pickled without the frames it indexes, see attach
+        state = self.__dict__.copy()
+        del state['attrs'], state['monthly']
+        return state
+
+    def attach(self, user_month_attrs, df_monthly):
+        # Set back the frames of an unpickled index. They must hold the rows
+        # it was built from in the same order, False when their sizes differ.
+        if len(user_month_attrs) != len(self._attrs_order) or len(df_monthly) != len(self._monthly_order):
+            return False
+        self.attrs = user_month_attrs
+        self.monthly = df_monthly
+        return True
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def __contains__(self, user_id):
+        i = np.searchsorted(self.user_ids, user_id)
+        return i < len(self.user_ids) and self.user_ids[i] == user_id
+
+    @staticmethod
+    def _take(frame, order, sorted_ids, user_id):
+        start = np.searchsorted(sorted_ids, user_id, side='left')
+        stop = np.searchsorted(sorted_ids, user_id, side='right')
+        return frame.iloc[order[start:stop]].reset_index(drop=True)
+
+    def user_rows(self, user_id):
+        # Attribute rows of one user ordered by month
+        return self._take(self.attrs, self._attrs_order, self._attrs_ids, user_id)
+
+    def user_months(self, user_id):
+        # Monthly volume and segment rows of one user ordered by month
+        return self._take(self.monthly, self._monthly_order, self._monthly_ids, user_id)
+
+    def search(self, prefix, limit=50):
+        # User IDs whose decimal form starts with prefix, shortest IDs first.
+        # Every ID with k more digits than the prefix lies in the range
+        # [prefix * 10**k, (prefix + 1) * 10**k), so each length is one
+        # binary search over the sorted IDs.
+        prefix = str(prefix).strip()
+        if not prefix.isdigit() or (len(prefix) > 1 and prefix[0] == '0') or len(self.user_ids) == 0:
+            return []
+        value = int(prefix)
+        max_digits = len(str(int(self.user_ids[-1])))
+        matches = []
+        # Zero is the only ID starting with the digit 0
+        max_extra = 0 if value == 0 else max(max_digits - len(prefix), 0)
+        for extra in range(max_extra + 1):
+            low, high = value * 10 ** extra, (value + 1) * 10 ** extra
+            start, stop = np.searchsorted(self.user_ids, [low, high])
+            matches.extend(self.user_ids[start:min(stop, start + limit - len(matches))].tolist())
+            if len(matches) >= limit:
+                break
+        return matches